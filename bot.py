@@ -1,15 +1,31 @@
+from services.startup import startup
 import asyncio
 import logging
 import sys
-import os
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import BotCommand
-from aiogram.client.default import DefaultBotProperties
-from core.config import settings
-from handlers.voice_handler import router as voice_router
+with startup.phase("import_config"):
+    from core.config import settings
+with startup.phase("import_aiogram"):
+    from aiohttp import web
+    from aiogram import Bot, Dispatcher
+    from aiogram.fsm.storage.base import BaseStorage
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiogram.fsm.storage.redis import RedisStorage
+    from aiogram.types import BotCommand
+    from aiogram.client.default import DefaultBotProperties
+with startup.phase("import_handlers"):
+    from handlers.voice_handler import router as voice_router
+    from handlers.middleware import MetricsMiddleware
+with startup.phase("import_services"):
+    from services.openai_service import OpenAIService, create_openai_client, warm_up_openai
+    from database.redis_storage import connect_redis
+    from database.thread_registry import create_thread_registry
+    from database.history import create_history_writer
+    from services.tts_cache import create_tts_cache
+    from services.transcription_cache import create_transcription_cache
+    from services.scheduler import PipelineScheduler
+    from services.metrics import metrics, start_metrics_server, handle_ready
+    from services.telegram_limiter import create_telegram_limiter
+    from services.spool import TempSpool
 
 
 logging.basicConfig(
@@ -19,9 +35,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class UserState(StatesGroup):
-    active = State()
-
 async def set_bot_commands(bot: Bot):
     """Установка команд меню для бота"""
     commands = [
@@ -31,11 +44,135 @@ async def set_bot_commands(bot: Bot):
     ]
     await bot.set_my_commands(commands)
 
-async def on_startup(bot: Bot):
-    await set_bot_commands(bot)
-    me = await bot.get_me()
+async def create_semantic_cache(client):
+    """Семантический кэш ответов, если он включен; модуль загружается только при необходимости"""
+    if not settings.semantic_cache_enabled:
+        return None
+    
+    from services.semantic_cache import SemanticCache
+    semantic_cache = SemanticCache(client)
+    await semantic_cache.refresh_corpus_version(force=True)
+    return semantic_cache
+
+async def load_retrieval_index():
+    """Локальный индекс документов, если он включен; строится в отдельном потоке"""
+    if not settings.local_retrieval_enabled:
+        return None
+    
+    from services.retrieval import build_retrieval_index
+    try:
+        retrieval_index = await asyncio.to_thread(build_retrieval_index)
+        logger.info(f" Локальный индекс загружен: {retrieval_index.size} фрагментов")
+        return retrieval_index
+    except Exception as e:
+        logger.error(f" Ошибка построения локального индекса: {e}")
+        return None
+
+async def warm_up_telegram(bot: Bot):
+    """Прогрев соединений с Bot API параллельными запросами, установка команд меню"""
+    _, *users = await asyncio.gather(
+        set_bot_commands(bot),
+        *[bot.get_me() for _ in range(max(1, settings.warmup_connections))]
+    )
+    return users[0]
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher):
+    scheduler = PipelineScheduler()
+    dispatcher["scheduler"] = scheduler
+    
+    if settings.metrics_enabled:
+        metrics.scheduler_queue.set_function(lambda: scheduler.queue_size)
+        metrics.scheduler_running.set_function(lambda: scheduler.running)
+        with startup.phase("metrics_server"):
+            dispatcher["metrics_runner"] = await start_metrics_server(
+                settings.metrics_port + dispatcher.workflow_data.get("worker_index", 0)
+            )
+    
+    client = create_openai_client()
+    telegram_limiter = create_telegram_limiter()
+    bot.session.middleware(telegram_limiter)
+    dispatcher["telegram_limiter"] = telegram_limiter
+    
+    (
+        tts_cache,
+        dispatcher["thread_registry"],
+        dispatcher["transcription_cache"],
+        dispatcher["history_writer"],
+        semantic_cache,
+        retrieval_index,
+        assistant,
+        me,
+    ) = await asyncio.gather(
+        startup.measure("tts_cache", create_tts_cache()),
+        startup.measure("thread_registry", create_thread_registry()),
+        startup.measure("transcription_cache", create_transcription_cache()),
+        startup.measure("history", create_history_writer()),
+        startup.measure("semantic_cache", create_semantic_cache(client)),
+        startup.measure("retrieval_index", load_retrieval_index()),
+        startup.measure("openai_warmup", warm_up_openai(client)),
+        startup.measure("telegram_warmup", warm_up_telegram(bot)),
+    )
+    
+    dispatcher["openai_service"] = OpenAIService(
+        client=client,
+        tts_cache=tts_cache,
+        semantic_cache=semantic_cache,
+        retrieval_index=retrieval_index,
+        assistant=assistant,
+        thread_registry=dispatcher["thread_registry"]
+    )
+    
+    spool = TempSpool()
+    spool.start_janitor()
+    dispatcher["spool"] = spool
+    
+    startup.mark_ready()
     logger.info(f" Бот @{me.username} успешно запущен!")
-    logger.info(" Используется MemoryStorage (Redis не доступен)")
+    logger.info(f" Используется {type(dispatcher.storage).__name__}")
+
+async def on_shutdown(dispatcher: Dispatcher):
+    openai_service = dispatcher.workflow_data.pop("openai_service", None)
+    if openai_service is not None:
+        await openai_service.close()
+        if openai_service.tts_cache is not None:
+            await openai_service.tts_cache.close()
+    
+    for name in ("thread_registry", "transcription_cache", "history_writer", "spool"):
+        resource = dispatcher.workflow_data.pop(name, None)
+        if resource is not None:
+            await resource.close()
+    
+    metrics_runner = dispatcher.workflow_data.pop("metrics_runner", None)
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+async def create_storage() -> BaseStorage:
+    """FSM storage на общем Redis; MemoryStorage допустим только в режиме polling"""
+    redis = await connect_redis()
+    if redis is not None:
+        return RedisStorage(redis=redis)
+    
+    if settings.bot_mode == "webhook":
+        raise RuntimeError("Режим webhook требует Redis для общего FSM storage")
+    
+    logger.warning(" Redis не доступен, используется MemoryStorage")
+    return MemoryStorage()
+
+def create_bot() -> Bot:
+    
+    return Bot(
+        token=settings.bot_token, 
+        default=DefaultBotProperties(parse_mode="HTML")
+    )
+
+def create_dispatcher(storage: BaseStorage) -> Dispatcher:
+    
+    dp = Dispatcher(storage=storage)
+    dp.message.middleware(MetricsMiddleware())
+    dp.include_router(voice_router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
 
 async def main():
     try:
@@ -46,21 +183,13 @@ async def main():
         logger.info(" Инициализация бота...")
         
         
-        storage = MemoryStorage()
-        
+        storage = await create_storage()
+        bot = create_bot()
+        dp = create_dispatcher(storage)
         
-        bot = Bot(
-            token=settings.bot_token, 
-            default=DefaultBotProperties(parse_mode="HTML")
-        )
-        
-        dp = Dispatcher(storage=storage)
-        
-      
-        dp.include_router(voice_router)
-        dp.startup.register(on_startup)
         
-        logger.info(" Бот запускается с MemoryStorage...")
+        await bot.delete_webhook()
+        logger.info(f" Бот запускается в режиме polling с {type(storage).__name__}...")
         await dp.start_polling(bot)
         
     except Exception as e:
@@ -68,9 +197,82 @@ async def main():
         import traceback
         traceback.print_exc()
 
+async def register_webhook():
+    """Регистрация webhook в Telegram один раз перед запуском воркеров"""
+    bot = create_bot()
+    try:
+        await bot.set_webhook(
+            url=f"{settings.webhook_base_url.rstrip('/')}{settings.webhook_path}",
+            secret_token=settings.webhook_secret,
+            allowed_updates=voice_router.resolve_used_update_types()
+        )
+        logger.info(f" Webhook зарегистрирован: {settings.webhook_base_url}{settings.webhook_path}")
+    finally:
+        await bot.session.close()
+
+async def create_webhook_app(worker_index: int = 0) -> web.Application:
+    
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    storage = await create_storage()
+    bot = create_bot()
+    dp = create_dispatcher(storage)
+    dp["worker_index"] = worker_index
+    
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=settings.webhook_secret
+    ).register(app, path=settings.webhook_path)
+    app.router.add_get("/ready", handle_ready)
+    setup_application(app, dp, bot=bot)
+    return app
+
+def run_webhook_worker(worker_index: int):
+    """Воркер webhook; все воркеры слушают один порт через SO_REUSEPORT, метрики - на METRICS_PORT + номер воркера"""
+    logger.info(f" Воркер {worker_index} слушает {settings.webhook_host}:{settings.webhook_port}")
+    web.run_app(
+        create_webhook_app(worker_index),
+        host=settings.webhook_host,
+        port=settings.webhook_port,
+        reuse_port=settings.webhook_workers > 1,
+        print=None
+    )
+
+def run_webhook():
+    
+    if not settings.webhook_base_url:
+        logger.error(" WEBHOOK_BASE_URL не задан!")
+        return
+    
+    asyncio.run(register_webhook())
+    
+    if settings.webhook_workers <= 1:
+        run_webhook_worker(0)
+        return
+    
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_webhook_worker, args=(index,), name=f"webhook-worker-{index}")
+        for index in range(settings.webhook_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if settings.bot_mode == "webhook":
+            run_webhook()
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info(" Бот остановлен")
     except Exception as e:
@@ -1,22 +1,145 @@
 from pydantic_settings import BaseSettings
-from pydantic import Field
+from pydantic import Field, model_validator
 from typing import Optional
 import os
 
 class Settings(BaseSettings):
     
     bot_token: str = Field(..., env="BOT_TOKEN")
+    bot_mode: str = Field("polling", env="BOT_MODE")
+    webhook_base_url: Optional[str] = Field(None, env="WEBHOOK_BASE_URL")
+    webhook_path: str = Field("/webhook", env="WEBHOOK_PATH")
+    webhook_secret: Optional[str] = Field(None, env="WEBHOOK_SECRET")
+    webhook_host: str = Field("0.0.0.0", env="WEBHOOK_HOST")
+    webhook_port: int = Field(8080, env="WEBHOOK_PORT")
+    webhook_workers: int = Field(1, env="WEBHOOK_WORKERS")
     
     
     openai_api_key: str = Field(..., env="OPENAI_API_KEY")
     assistant_id: str = Field(..., env="ASSISTANT_ID")
+    openai_max_connections: int = Field(100, env="OPENAI_MAX_CONNECTIONS")
+    openai_max_keepalive_connections: int = Field(20, env="OPENAI_MAX_KEEPALIVE_CONNECTIONS")
+    openai_keepalive_expiry: float = Field(30.0, env="OPENAI_KEEPALIVE_EXPIRY")
+    openai_http2: bool = Field(False, env="OPENAI_HTTP2")
+    openai_timeout: float = Field(60.0, env="OPENAI_TIMEOUT")
+    warmup_connections: int = Field(2, ge=0, env="WARMUP_CONNECTIONS")
+    
+    
+    assistant_streaming: bool = Field(True, env="ASSISTANT_STREAMING")
+    answer_engine: str = Field("assistants", env="ANSWER_ENGINE")
+    chat_model: str = Field("gpt-4o-mini", env="CHAT_MODEL")
+    chat_instructions: Optional[str] = Field(None, env="CHAT_INSTRUCTIONS")
+    chat_history_turns: int = Field(10, env="CHAT_HISTORY_TURNS")
+    chat_max_sessions: int = Field(10000, env="CHAT_MAX_SESSIONS")
+    assistant_poll_initial_delay: float = Field(0.25, env="ASSISTANT_POLL_INITIAL_DELAY")
+    assistant_poll_backoff: float = Field(1.5, env="ASSISTANT_POLL_BACKOFF")
+    assistant_poll_max_delay: float = Field(2.0, env="ASSISTANT_POLL_MAX_DELAY")
+    stream_edit_interval: float = Field(1.0, env="STREAM_EDIT_INTERVAL")
+    
+    telegram_global_rate: float = Field(30.0, env="TELEGRAM_GLOBAL_RATE")
+    telegram_chat_rate: float = Field(1.0, env="TELEGRAM_CHAT_RATE")
+    telegram_chat_burst: int = Field(3, env="TELEGRAM_CHAT_BURST")
+    telegram_status_max_wait: float = Field(0.5, env="TELEGRAM_STATUS_MAX_WAIT")
+    telegram_max_retries: int = Field(3, env="TELEGRAM_MAX_RETRIES")
+    
+    
+    tts_model: str = Field("tts-1", env="TTS_MODEL")
+    tts_voice: str = Field("alloy", env="TTS_VOICE")
+    tts_profile: str = Field("voice", env="TTS_PROFILE")
+    tts_speed: Optional[float] = Field(None, env="TTS_SPEED")
+    tts_first_chunk_chars: int = Field(120, env="TTS_FIRST_CHUNK_CHARS")
+    tts_chunk_max_chars: int = Field(600, env="TTS_CHUNK_MAX_CHARS")
+    tts_pipeline_parallelism: int = Field(3, env="TTS_PIPELINE_PARALLELISM")
+    tts_cache_backend: str = Field("disk", env="TTS_CACHE_BACKEND")
+    tts_cache_dir: str = Field("cache/tts", env="TTS_CACHE_DIR")
+    tts_cache_max_bytes: int = Field(256 * 1024 * 1024, env="TTS_CACHE_MAX_BYTES")
+    transcription_cache_ttl: int = Field(7 * 24 * 3600, env="TRANSCRIPTION_CACHE_TTL")
+    transcription_cache_max_entries: int = Field(10000, env="TRANSCRIPTION_CACHE_MAX_ENTRIES")
+    
+    audio_preprocessing: bool = Field(True, env="AUDIO_PREPROCESSING")
+    stt_sample_rate: int = Field(16000, env="STT_SAMPLE_RATE")
+    stt_bitrate: str = Field("24k", env="STT_BITRATE")
+    vad_frame_ms: int = Field(30, env="VAD_FRAME_MS")
+    vad_threshold_db: float = Field(-45.0, env="VAD_THRESHOLD_DB")
+    vad_noise_margin_db: float = Field(10.0, env="VAD_NOISE_MARGIN_DB")
+    vad_peak_margin_db: float = Field(6.0, env="VAD_PEAK_MARGIN_DB")
+    vad_padding_ms: int = Field(300, env="VAD_PADDING_MS")
+    vad_min_speech_ms: int = Field(200, env="VAD_MIN_SPEECH_MS")
+    stt_segment_seconds: float = Field(180.0, env="STT_SEGMENT_SECONDS")
+    stt_segment_overlap: float = Field(1.0, env="STT_SEGMENT_OVERLAP")
+    stt_segment_parallelism: int = Field(10, env="STT_SEGMENT_PARALLELISM")
+    semantic_cache_enabled: bool = Field(True, env="SEMANTIC_CACHE_ENABLED")
+    semantic_cache_embedding_model: str = Field("text-embedding-3-small", env="SEMANTIC_CACHE_EMBEDDING_MODEL")
+    semantic_cache_threshold: float = Field(0.92, env="SEMANTIC_CACHE_THRESHOLD")
+    semantic_cache_ttl: int = Field(24 * 3600, env="SEMANTIC_CACHE_TTL")
+    semantic_cache_capacity: int = Field(2048, env="SEMANTIC_CACHE_CAPACITY")
+    semantic_cache_corpus_check_interval: float = Field(60.0, env="SEMANTIC_CACHE_CORPUS_CHECK_INTERVAL")
+    
+    
+    scheduler_max_concurrent: int = Field(16, env="SCHEDULER_MAX_CONCURRENT")
+    scheduler_max_queue: int = Field(200, env="SCHEDULER_MAX_QUEUE")
+    scheduler_max_per_user: int = Field(3, env="SCHEDULER_MAX_PER_USER")
+    scheduler_stt_concurrency: int = Field(8, env="SCHEDULER_STT_CONCURRENCY")
+    scheduler_assistant_concurrency: int = Field(12, env="SCHEDULER_ASSISTANT_CONCURRENCY")
+    scheduler_tts_concurrency: int = Field(8, env="SCHEDULER_TTS_CONCURRENCY")
+    
+    message_deadline: float = Field(120.0, env="MESSAGE_DEADLINE")
+    stt_budget: float = Field(30.0, env="STT_BUDGET")
+    assistant_budget: float = Field(75.0, env="ASSISTANT_BUDGET")
+    tts_budget: float = Field(20.0, env="TTS_BUDGET")
+    hedging_enabled: bool = Field(True, env="HEDGING_ENABLED")
+    hedge_percentile: float = Field(0.95, env="HEDGE_PERCENTILE")
+    hedge_min_samples: int = Field(20, env="HEDGE_MIN_SAMPLES")
+    breaker_failure_threshold: int = Field(5, env="BREAKER_FAILURE_THRESHOLD")
+    breaker_reset_timeout: float = Field(30.0, env="BREAKER_RESET_TIMEOUT")
     
     
     redis_url: str = Field("redis://localhost:6379/0", env="REDIS_URL")
+    thread_idle_ttl: int = Field(3600, env="THREAD_IDLE_TTL")
+    
+    compaction_enabled: bool = Field(True, env="COMPACTION_ENABLED")
+    compaction_last_messages: int = Field(20, env="COMPACTION_LAST_MESSAGES")
+    compaction_max_prompt_tokens: Optional[int] = Field(None, env="COMPACTION_MAX_PROMPT_TOKENS")
+    compaction_trigger_messages: int = Field(16, env="COMPACTION_TRIGGER_MESSAGES")
+    compaction_keep_messages: int = Field(6, env="COMPACTION_KEEP_MESSAGES")
+    
+    database_url: str = Field("sqlite+aiosqlite:///cache/history.db", env="DATABASE_URL")
+    history_queue_size: int = Field(1000, env="HISTORY_QUEUE_SIZE")
+    history_batch_size: int = Field(100, env="HISTORY_BATCH_SIZE")
+    history_flush_interval: float = Field(2.0, env="HISTORY_FLUSH_INTERVAL")
+    history_page_size: int = Field(20, env="HISTORY_PAGE_SIZE")
+    
+    metrics_enabled: bool = Field(True, env="METRICS_ENABLED")
+    metrics_host: str = Field("127.0.0.1", env="METRICS_HOST")
+    metrics_port: int = Field(9100, env="METRICS_PORT")
+    
+    spool_dir: str = Field("temp", env="SPOOL_DIR")
+    spool_use_shm: bool = Field(False, env="SPOOL_USE_SHM")
+    spool_file_ttl: int = Field(3600, env="SPOOL_FILE_TTL")
+    spool_janitor_interval: float = Field(300.0, env="SPOOL_JANITOR_INTERVAL")
     
     
     document_path: str = Field("documents/тревожность.docx", env="DOCUMENT_PATH")
     vector_store_id: Optional[str] = Field(None, env="VECTOR_STORE_ID")
+    document_sync_manifest: str = Field("cache/vector_store_manifest.json", env="DOCUMENT_SYNC_MANIFEST")
+    document_sync_concurrency: int = Field(4, env="DOCUMENT_SYNC_CONCURRENCY")
+    local_retrieval_enabled: bool = Field(True, env="LOCAL_RETRIEVAL_ENABLED")
+    retrieval_index_dir: str = Field("cache/retrieval", env="RETRIEVAL_INDEX_DIR")
+    retrieval_chunk_chars: int = Field(800, env="RETRIEVAL_CHUNK_CHARS")
+    retrieval_top_k: int = Field(3, env="RETRIEVAL_TOP_K")
+    retrieval_instructions: str = Field(
+        "Отвечай, опираясь на следующие фрагменты документов:",
+        env="RETRIEVAL_INSTRUCTIONS"
+    )
+    
+    @model_validator(mode="after")
+    def check_stt_segments(self) -> "Settings":
+        """Разрез ищется в последней трети сегмента, поэтому перекрытие должно быть меньше двух третей его длины"""
+        if self.stt_segment_seconds <= 0:
+            raise ValueError("STT_SEGMENT_SECONDS должен быть больше нуля")
+        if not 0 <= self.stt_segment_overlap < self.stt_segment_seconds * 2 / 3:
+            raise ValueError("STT_SEGMENT_OVERLAP должен быть от 0 и меньше двух третей STT_SEGMENT_SECONDS")
+        return self
     
     class Config:
         env_file = ".env"
@@ -9,3 +9,11 @@ class VoiceProcessingError(OpenAIServiceError):
 class AssistantError(OpenAIServiceError):
     
     pass
+
+class QueueFullError(Exception):
+    
+    pass
+
+class UpdateDroppedError(Exception):
+    
+    pass
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple, Type
+from sqlalchemy import insert, select, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from core.config import settings
+from database.models import Base, UserSession, ConversationHistory
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class HistoryWriter:
+    """Отложенная запись истории диалогов в базу данных.
+
+    Обработчики только кладут записи в ограниченную очередь в памяти и не
+    ждут базу. Фоновая задача собирает записи в пачки и пишет их одним
+    bulk insert, как только набралось batch_size записей или прошло
+    flush_interval секунд с первой записи пачки. При переполнении очереди
+    новые записи отбрасываются с предупреждением. Если пачка не записалась,
+    ее строки пишутся по одной, и теряются только ошибочные.
+    """
+
+    def __init__(self, engine: AsyncEngine, queue_size: Optional[int] = None,
+                 batch_size: Optional[int] = None, flush_interval: Optional[float] = None):
+        self._engine = engine
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or settings.history_queue_size)
+        self._batch_size = batch_size or settings.history_batch_size
+        self._flush_interval = flush_interval or settings.history_flush_interval
+        self._worker: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        """Создание таблиц и запуск фоновой записи"""
+        async with self._engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self._worker = asyncio.create_task(self._run())
+
+    def _enqueue(self, model: Type[Base], row: Dict[str, Any]) -> None:
+
+        try:
+            self._queue.put_nowait((model, row))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f" Очередь истории переполнена, запись отброшена (всего {self.dropped})")
+
+    def record_message(self, user_id: int, user_message: str, assistant_response: str) -> None:
+        """Постановка сообщения и ответа в очередь записи"""
+        self._enqueue(ConversationHistory, {
+            'user_id': user_id,
+            'user_message': user_message,
+            'assistant_response': assistant_response,
+            'created_at': datetime.utcnow()
+        })
+
+    def record_session(self, user_id: int, thread_id: str) -> None:
+        """Постановка нового треда пользователя в очередь записи"""
+        self._enqueue(UserSession, {
+            'user_id': user_id,
+            'thread_id': thread_id,
+            'created_at': datetime.utcnow()
+        })
+
+    async def _run(self) -> None:
+
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            deadline = loop.time() + self._flush_interval
+            stop = False
+            while len(batch) < self._batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._write(batch)
+            if stop:
+                return
+
+    async def _write(self, batch: List[Tuple[Type[Base], Dict[str, Any]]]) -> None:
+
+        rows: Dict[Type[Base], List[Dict[str, Any]]] = {}
+        for model, row in batch:
+            rows.setdefault(model, []).append(row)
+
+        try:
+            async with self._engine.begin() as conn:
+                for model, values in rows.items():
+                    await conn.execute(insert(model), values)
+            self.written += len(batch)
+        except Exception as e:
+            logger.warning(f" Ошибка записи пачки истории из {len(batch)} записей, запись по одной: {e}")
+            await self._write_rows(batch)
+
+    async def _write_rows(self, batch: List[Tuple[Type[Base], Dict[str, Any]]]) -> None:
+        """Запись по одной строке, чтобы ошибочная запись не уносила всю пачку"""
+        for model, row in batch:
+            try:
+                async with self._engine.begin() as conn:
+                    await conn.execute(insert(model), [row])
+                self.written += 1
+            except Exception as e:
+                self.dropped += 1
+                logger.error(f" Ошибка записи истории пользователя {row.get('user_id')}, запись потеряна: {e}")
+
+    async def get_history(self, user_id: int, limit: Optional[int] = None,
+                          before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Последние сообщения пользователя, от новых к старым.
+
+        Пагинация по курсору: для следующей страницы передается id последней
+        записи текущей. Запрос обслуживается индексом (user_id, id).
+        """
+        query = (
+            select(ConversationHistory)
+            .where(ConversationHistory.user_id == user_id)
+            .order_by(ConversationHistory.id.desc())
+            .limit(limit or settings.history_page_size)
+        )
+        if before_id is not None:
+            query = query.where(ConversationHistory.id < before_id)
+
+        async with self._engine.connect() as conn:
+            result = await conn.execute(query)
+            return [dict(row) for row in result.mappings()]
+
+    async def close(self) -> None:
+        """Запись всех накопленных сообщений и закрытие соединений"""
+        if self._worker is not None:
+            await self._queue.put(_STOP)
+            await self._worker
+        logger.info(f" История: записано {self.written}, отброшено {self.dropped}")
+        await self._engine.dispose()
+
+async def create_history_writer() -> HistoryWriter:
+    """Запуск записи истории в базу из настроек"""
+    url = make_url(settings.database_url)
+    if url.get_backend_name() == "sqlite" and url.database:
+        Path(url.database).parent.mkdir(parents=True, exist_ok=True)
+    
+    engine = create_async_engine(url)
+    writer = HistoryWriter(engine)
+    await writer.start()
+    return writer
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Text, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -9,15 +9,16 @@ class UserSession(Base):
     __tablename__ = "user_sessions"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, index=True)
+    user_id = Column(BigInteger, index=True)
     thread_id = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
     
 class ConversationHistory(Base):
     __tablename__ = "conversation_history"
+    __table_args__ = (Index("ix_conversation_history_user_id_id", "user_id", "id"),)
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, index=True)
+    user_id = Column(BigInteger, index=True)
     user_message = Column(Text)
     assistant_response = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
@@ -1,8 +1,26 @@
+import logging
+from typing import Optional
 from aiogram.fsm.storage.redis import RedisStorage
 from redis.asyncio import Redis
 from core.config import settings
 
+logger = logging.getLogger(__name__)
+
 def get_redis_storage():
     """Инициализация Redis storage для FSM"""
     redis = Redis.from_url(settings.redis_url, decode_responses=True)
-    return RedisStorage(redis=redis)
\ No newline at end of file
+    return RedisStorage(redis=redis)
+
+async def connect_redis(decode_responses: bool = True) -> Optional[Redis]:
+    """Подключение к Redis из общего storage; None если Redis недоступен"""
+    if decode_responses:
+        redis = get_redis_storage().redis
+    else:
+        redis = Redis.from_url(settings.redis_url)
+    try:
+        await redis.ping()
+        return redis
+    except Exception as e:
+        logger.warning(f" Redis недоступен: {e}")
+        await redis.aclose()
+        return None
@@ -0,0 +1,123 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+from redis.asyncio import Redis
+from core.config import settings
+from database.redis_storage import connect_redis
+
+logger = logging.getLogger(__name__)
+
+class ThreadRegistry:
+    """Реестр тредов ассистента по Telegram user id с истечением по простою.
+
+    Основное хранилище - Redis, общий для воркеров. Записи дублируются в
+    памяти процесса (LRU с ограничением размера и тем же TTL), и при ошибке
+    Redis реестр продолжает работать по локальным данным.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, ttl: Optional[int] = None, prefix: str = "assistant_thread",
+                 max_entries: int = 10000):
+        self._redis = redis
+        self._ttl = ttl or settings.thread_idle_ttl
+        self._prefix = prefix
+        self._max_entries = max_entries
+        self._local: "OrderedDict[Union[int, str], Tuple[str, float]]" = OrderedDict()
+
+    def _key(self, user_id: int) -> str:
+        return f"{self._prefix}:{user_id}"
+
+    def _replacement_key(self, thread_id: str) -> str:
+        return f"{self._prefix}_replacement:{thread_id}"
+
+    def _get_local(self, user_id: Union[int, str]) -> Optional[str]:
+
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        thread_id, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._local[user_id]
+            return None
+        self._set_local(user_id, thread_id)
+        return thread_id
+
+    def _set_local(self, user_id: Union[int, str], thread_id: str) -> None:
+
+        self._local[user_id] = (thread_id, time.monotonic() + self._ttl)
+        self._local.move_to_end(user_id)
+        while len(self._local) > self._max_entries:
+            self._local.popitem(last=False)
+
+    async def get(self, user_id: int) -> Optional[str]:
+        """Получение треда пользователя с продлением срока жизни"""
+        if self._redis is not None:
+            try:
+                thread_id = await self._redis.getex(self._key(user_id), ex=self._ttl)
+            except Exception as e:
+                logger.warning(f" Ошибка чтения реестра тредов, используется память процесса: {e}")
+            else:
+                if thread_id is None:
+                    self._local.pop(user_id, None)
+                else:
+                    self._set_local(user_id, thread_id)
+                return thread_id
+
+        return self._get_local(user_id)
+
+    async def set(self, user_id: int, thread_id: str) -> None:
+
+        self._set_local(user_id, thread_id)
+        if self._redis is not None:
+            try:
+                await self._redis.set(self._key(user_id), thread_id, ex=self._ttl)
+            except Exception as e:
+                logger.warning(f" Ошибка записи в реестр тредов: {e}")
+
+    async def reset(self, user_id: int) -> None:
+
+        self._local.pop(user_id, None)
+        if self._redis is not None:
+            try:
+                await self._redis.delete(self._key(user_id))
+            except Exception as e:
+                logger.warning(f" Ошибка удаления из реестра тредов: {e}")
+
+    async def get_replacement(self, thread_id: str) -> Optional[str]:
+        """Тред, заменивший указанный после сжатия, с продлением срока жизни"""
+        key = self._replacement_key(thread_id)
+        if self._redis is not None:
+            try:
+                replacement = await self._redis.getex(key, ex=self._ttl)
+            except Exception as e:
+                logger.warning(f" Ошибка чтения замены треда, используется память процесса: {e}")
+            else:
+                if replacement is not None:
+                    self._set_local(key, replacement)
+                return replacement
+
+        return self._get_local(key)
+
+    async def set_replacement(self, thread_id: str, replacement: str) -> None:
+        """Замена треда сжатым, общая для всех воркеров"""
+        key = self._replacement_key(thread_id)
+        self._set_local(key, replacement)
+        if self._redis is not None:
+            try:
+                await self._redis.set(key, replacement, ex=self._ttl)
+            except Exception as e:
+                logger.warning(f" Ошибка записи замены треда: {e}")
+
+    async def close(self) -> None:
+
+        if self._redis is not None:
+            await self._redis.aclose()
+
+async def create_thread_registry() -> ThreadRegistry:
+    """Реестр тредов на общем Redis, либо в памяти процесса если Redis недоступен"""
+    redis = await connect_redis()
+    if redis is None:
+        logger.warning(" Реестр тредов хранится в памяти процесса")
+    else:
+        logger.info(" Реестр тредов использует Redis")
+    return ThreadRegistry(redis)
@@ -0,0 +1,26 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+from services.metrics import metrics
+
+class MetricsMiddleware(BaseMiddleware):
+    """Счетчик сообщений и полное время их обработки по типу содержимого"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        content_type = event.content_type.value
+        metrics.updates.inc(content_type=content_type)
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            metrics.stage_errors.inc(stage="handler", error=type(e).__name__)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - started, content_type=content_type)
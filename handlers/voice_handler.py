@@ -1,35 +1,76 @@
 from aiogram import Router, F
-from aiogram.types import Message, Voice
+from aiogram.types import Message, BufferedInputFile
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from services.openai_service import OpenAIService
+from core.config import settings
+from database.thread_registry import ThreadRegistry
+from database.history import HistoryWriter
+from services.transcription_cache import TranscriptionCache
+from services.scheduler import PipelineScheduler, PRIORITY_TEXT, PRIORITY_VOICE
+from services.openai_service import OpenAIService, AnswerStream, get_tts_profile
+from services.tts_pipeline import TTSPipeline
 from services.voice_service import VoiceService
-from core.exeptions import OpenAIServiceError
+from services.metrics import metrics
+from services.telegram_limiter import TelegramRateLimiter, StatusMessage
+from services.resilience import Deadline
+from core.exeptions import OpenAIServiceError, QueueFullError
+import asyncio
 import logging
-import os
+from typing import Optional, Union, Callable
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-def get_openai_service():
-    
-    try:
-        service = OpenAIService()
-        
-        if hasattr(service, 'client') and service.client is not None:
-            logger.info(" OpenAI сервис успешно инициализирован")
-            return service
-        else:
-            logger.error(" OpenAI сервис создан, но клиент не инициализирован")
-            return None
-    except Exception as e:
-        logger.error(f" Ошибка создания OpenAI сервиса: {e}")
-        return None
-
 def get_voice_service():
     
     return VoiceService()
 
+def queue_position_updater(status: StatusMessage):
+    """Показ позиции в очереди в сообщении о статусе"""
+    async def update(position: int):
+        status.update(f" Вы в очереди: {position}. Ответ начнет формироваться, как только освободится место...")
+    return update
+
+def transcript_progress_updater(status: StatusMessage):
+    """Показ частичной транскрипции длинной записи по мере готовности сегментов"""
+    def update(done: int, total: int, text: str):
+        status.update(f" Преобразую речь в текст: {done} из {total}...\n\n{text}")
+    return update
+
+def voice_segment_sender(message: Message, extension: str):
+    """Отправка аудио сегментов ответа; возвращает file_id загруженного голосового"""
+    async def send(index: int, audio: Union[str, bytes], text: str) -> Optional[str]:
+        caption = " Аудио ответ:" if index == 0 else None
+        with metrics.stage("upload"):
+            if isinstance(audio, str):
+                await message.reply_voice(voice=audio, caption=caption)
+                return audio
+            
+            sent = await message.reply_voice(
+                voice=BufferedInputFile(audio, filename=f"response_{message.from_user.id}_{message.message_id}_{index}.{extension}"),
+                caption=caption
+            )
+        return sent.voice.file_id if sent.voice else None
+    return send
+
+async def stream_to_message(status: StatusMessage, stream: AnswerStream, prefix: str,
+                            on_delta: Optional[Callable[[str], None]] = None) -> None:
+    """Постепенный вывод потокового ответа ассистента в сообщение"""
+    loop = asyncio.get_running_loop()
+    last_edit = loop.time()
+    parts = []
+    
+    async for delta in stream:
+        parts.append(delta)
+        if on_delta is not None:
+            on_delta(delta)
+        now = loop.time()
+        if now - last_edit < settings.stream_edit_interval:
+            continue
+        
+        last_edit = now
+        status.update(f"{prefix}{''.join(parts)}...")
+
 @router.message(Command("start"))
 async def cmd_start(message: Message):
    
@@ -50,17 +91,18 @@ async def cmd_help(message: Message):
         "Бот использует OpenAI для обработки запросов."
     )
 
+@router.message(Command("reset"))
+async def cmd_reset(message: Message, state: FSMContext, thread_registry: ThreadRegistry):
+    
+    await thread_registry.reset(message.from_user.id)
+    await state.clear()
+    await message.answer(" История диалога сброшена. Следующее сообщение начнет новый разговор.")
+
 @router.message(Command("test"))
-async def cmd_test(message: Message):
+async def cmd_test(message: Message, openai_service: OpenAIService):
    
     try:
-        service = get_openai_service()
-        if service is None:
-            await message.answer(" Сервис OpenAI не инициализирован")
-            return
-        
-        
-        models = await service.client.models.list()
+        models = await openai_service.client.models.list()
         model_count = len(models.data)
         
         await message.answer(f" Сервис OpenAI работает! Доступно моделей: {model_count}")
@@ -70,96 +112,108 @@ async def cmd_test(message: Message):
 
 
 @router.message(F.voice | F.audio | F.document)
-<<<<<<< HEAD
-async def handle_voice_message(message: Message, state: FSMContext):
+async def handle_voice_message(message: Message, openai_service: OpenAIService, thread_registry: ThreadRegistry,
+                               transcription_cache: TranscriptionCache, scheduler: PipelineScheduler,
+                               history_writer: HistoryWriter, telegram_limiter: TelegramRateLimiter):
     """Обработка голосовых сообщений"""
-=======
-async def handle_voice_message(message: Message):
-    
->>>>>>> 4560863a39e9d12190037f91d894d04e36fecce2
     user_id = message.from_user.id
     
-    openai_service = get_openai_service()
     voice_service = get_voice_service()
     
-    if openai_service is None:
-        await message.reply(" Сервис OpenAI временно недоступен. Проверьте настройки.")
-        return
-    
-    voice_path = None
-    audio_response_path = None
-    
     try:
         processing_msg = await message.reply(" Обрабатываю голосовое сообщение...")
+        async with (
+            StatusMessage(processing_msg, telegram_limiter) as status,
+            scheduler.job(user_id, PRIORITY_VOICE, on_position=queue_position_updater(status)),
+        ):
+            deadline = Deadline()
+            media = message.voice or message.audio or message.document
+            file_id = media.file_id
         
-        if message.voice:
-            file_id = message.voice.file_id
-        elif message.audio:
-            file_id = message.audio.file_id
-        else:
-            file_id = message.document.file_id
-        
-        voice_path = await voice_service.download_voice_file(file_id, message.bot)
-        
-        await processing_msg.edit_text(" Преобразую речь в текст...")
-        user_text = await openai_service.transcribe_audio(voice_path)
-        
-        if not user_text.strip():
-            await processing_msg.edit_text("Не удалось распознать речь в сообщении")
-            return
-        
-        await processing_msg.edit_text(f" Ваш вопрос: {user_text}\n\n Формирую ответ...")
-        
-       
-        assistant_response, thread_id, response_metadata = await openai_service.get_assistant_response(user_text)
-        
-        
-        await state.update_data(thread_id=thread_id)
-        
-        
-        if response_metadata.get('file_citations'):
-            citations_info = f"\n\n Источники: использовано {len(response_metadata['file_citations'])} цитат из документа"
-            assistant_response += citations_info
-        
-        
-        if len(assistant_response) > 4096:
-            assistant_response = assistant_response[:4096] + "..."
-        
-        await processing_msg.edit_text(f" Ваш вопрос: {user_text}\n\n Ответ: {assistant_response}\n\n Создаю аудио ответ...")
+            user_text = await transcription_cache.get(media.file_unique_id)
+            if user_text is None:
+                voice_buffer = await voice_service.download_voice_file(file_id, message.bot)
+            
+                status.update(" Преобразую речь в текст...")
+                segments = await voice_service.preprocess_audio(voice_buffer)
+                if segments is None:
+                    user_text = ""
+                else:
+                    user_text = await openai_service.transcribe_segments(
+                        segments, deadline, on_partial=transcript_progress_updater(status),
+                        stage=lambda: scheduler.stage("stt")
+                    )
+                await transcription_cache.set(media.file_unique_id, user_text)
+            else:
+                logger.info(f" Транскрибация взята из кэша: {media.file_unique_id}")
         
+            if not user_text.strip():
+                await status.final("Не удалось распознать речь в сообщении")
+                return
         
-        os.makedirs("temp", exist_ok=True)
-        audio_response_path = f"temp/response_{user_id}_{message.message_id}.mp3"
+            status.update(f" Ваш вопрос: {user_text}\n\n Формирую ответ...")
         
-        try:
-            
-            await openai_service.text_to_speech(assistant_response, audio_response_path)
-            
-           
-            if os.path.exists(audio_response_path) and os.path.getsize(audio_response_path) > 0:
-                with open(audio_response_path, 'rb') as audio_file:
-                    await message.reply_voice(
-                        voice=audio_file,
-                        caption=" Аудио ответ:"
+            previous_thread_id = await thread_registry.get(user_id)
+            async with TTSPipeline(
+                openai_service,
+                send_segment=voice_segment_sender(message, get_tts_profile()['extension']),
+                stage=lambda: scheduler.stage("tts"),
+                deadline=deadline
+            ) as tts_pipeline:
+                stream = openai_service.stream_assistant_response(user_text, previous_thread_id, deadline)
+                async with scheduler.stage("assistant"):
+                    await stream_to_message(
+                        status,
+                        stream,
+                        prefix=f" Ваш вопрос: {user_text}\n\n Ответ: ",
+                        on_delta=tts_pipeline.feed
                     )
-                await processing_msg.delete()
-            else:
+                assistant_response, thread_id, response_metadata = stream.result()
                 
-                await processing_msg.edit_text(
-                    f" Ваш вопрос: {user_text}\n\n"
-                    f" Ответ: {assistant_response}\n\n"
-                    f" Не удалось создать аудио версию ответа"
-                )
                 
-        except Exception as tts_error:
-            logger.error(f"Ошибка TTS: {tts_error}")
-            
-            await processing_msg.edit_text(
-                f" Ваш вопрос: {user_text}\n\n"
-                f" Ответ: {assistant_response}\n\n"
-                f" Аудио ответ временно недоступен"
-            )
+                if thread_id:
+                    await thread_registry.set(user_id, thread_id)
+                    if thread_id != previous_thread_id:
+                        history_writer.record_session(user_id, thread_id)
+                history_writer.record_message(user_id, user_text, assistant_response)
+                
+                
+                if response_metadata.get('file_citations'):
+                    citations_info = f"\n\n Источники: использовано {len(response_metadata['file_citations'])} цитат из документа"
+                    assistant_response += citations_info
+                
+                
+                if len(assistant_response) > 4096:
+                    assistant_response = assistant_response[:4096] + "..."
+                
+                status.update(f" Ваш вопрос: {user_text}\n\n Ответ: {assistant_response}\n\n Создаю аудио ответ...")
+                
+                
+                try:
+                    
+                    segments_sent = await tts_pipeline.finish()
+                    
+                    if segments_sent:
+                        await status.delete()
+                    else:
+                        
+                        await status.final(
+                            f" Ваш вопрос: {user_text}\n\n"
+                            f" Ответ: {assistant_response}\n\n"
+                            f" Не удалось создать аудио версию ответа"
+                        )
+                    
+                except Exception as tts_error:
+                    logger.error(f"Ошибка TTS: {tts_error}")
+                    
+                    await status.final(
+                        f" Ваш вопрос: {user_text}\n\n"
+                        f" Ответ: {assistant_response}\n\n"
+                        f" Аудио ответ временно недоступен"
+                    )
         
+    except QueueFullError:
+        await message.reply(" Сейчас слишком много запросов, попробуйте через минуту")
     except OpenAIServiceError as e:
         await message.reply(f" Ошибка сервиса: {str(e)}")
         logger.error(f"OpenAI Service Error: {str(e)}")
@@ -168,41 +222,43 @@ async def handle_voice_message(message: Message):
         logger.error(f"Unexpected error: {str(e)}")
         import traceback
         traceback.print_exc()
-    finally:
-        
-        if voice_path or audio_response_path:
-            voice_service.cleanup_files(voice_path, audio_response_path)
 
 @router.message(F.text)
-<<<<<<< HEAD
-async def handle_text_message(message: Message, state: FSMContext):
+async def handle_text_message(message: Message, openai_service: OpenAIService, thread_registry: ThreadRegistry,
+                              scheduler: PipelineScheduler, history_writer: HistoryWriter,
+                              telegram_limiter: TelegramRateLimiter):
     """Обработка текстовых сообщений"""
-=======
-async def handle_text_message(message: Message):
-   
->>>>>>> 4560863a39e9d12190037f91d894d04e36fecce2
-    openai_service = get_openai_service()
-    
-    if openai_service is None:
-        await message.reply(" Сервис OpenAI временно недоступен. Проверьте настройки.")
-        return
+    user_id = message.from_user.id
     
     try:
         processing_msg = await message.reply(" Обрабатываю текстовое сообщение...")
+        async with (
+            StatusMessage(processing_msg, telegram_limiter) as status,
+            scheduler.job(user_id, PRIORITY_TEXT, on_position=queue_position_updater(status)),
+        ):
+            deadline = Deadline()
+            previous_thread_id = await thread_registry.get(user_id)
+            stream = openai_service.stream_assistant_response(message.text, previous_thread_id, deadline)
+            async with scheduler.stage("assistant"):
+                await stream_to_message(status, stream, prefix=" Ответ: ")
+            assistant_response, thread_id, response_metadata = stream.result()
         
         
-        assistant_response, thread_id, response_metadata = await openai_service.get_assistant_response(message.text)
-        
-        
-        await state.update_data(thread_id=thread_id)
+            if thread_id:
+                await thread_registry.set(user_id, thread_id)
+                if thread_id != previous_thread_id:
+                    history_writer.record_session(user_id, thread_id)
+            history_writer.record_message(user_id, message.text, assistant_response)
         
         
-        if response_metadata.get('file_citations'):
-            citations_info = f"\n\n Источники: использовано {len(response_metadata['file_citations'])} цитат из документа"
-            assistant_response += citations_info
+            if response_metadata.get('file_citations'):
+                citations_info = f"\n\n Источники: использовано {len(response_metadata['file_citations'])} цитат из документа"
+                assistant_response += citations_info
         
-        await processing_msg.edit_text(f" Ответ: {assistant_response}")
+            await status.final(f" Ответ: {assistant_response}")
         
+    except QueueFullError:
+        await message.reply(" Сейчас слишком много запросов, попробуйте через минуту")
     except OpenAIServiceError as e:
         await message.reply(f" Ошибка сервиса: {str(e)}")
     except Exception as e:
@@ -0,0 +1,265 @@
+import sys
+import argparse
+import asyncio
+import io
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from core.config import settings
+from services.openai_service import OpenAIService, create_openai_client, get_tts_profile
+from services.resilience import Deadline
+from services.voice_service import VoiceService
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK = "ok"
+STATUS_NO_SPEECH = "no_speech"
+STATUS_ERROR = "error"
+
+Stage = Callable[[Dict[str, Any]], Awaitable[None]]
+
+def file_signature(path: Path) -> Dict[str, int]:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def load_manifest(path: Path) -> Dict[str, Dict[str, Any]]:
+    """Последняя запись по каждому файлу; оборванная последняя строка пропускается"""
+    records: Dict[str, Dict[str, Any]] = {}
+    if not path.exists():
+        return records
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f" Пропущена поврежденная строка манифеста: {line[:80]!r}")
+                continue
+            records[record["file"]] = record
+    return records
+
+def is_done(record: Optional[Dict[str, Any]], signature: Dict[str, int]) -> bool:
+    """Файл обработан, если он не менялся с прошлого прогона и прогон завершился без ошибки"""
+    return (
+        record is not None
+        and record.get("status") in (STATUS_OK, STATUS_NO_SPEECH)
+        and record.get("size") == signature["size"]
+        and record.get("mtime_ns") == signature["mtime_ns"]
+    )
+
+class BatchPipeline:
+    """Потоковая обработка архива аудио: STT -> ассистент -> TTS.
+
+    У каждого этапа свой пул воркеров и ограниченная очередь на входе,
+    поэтому файлы идут по этапам независимо друг от друга, а медленный
+    этап сдерживает чтение новых файлов. Результат каждого файла сразу
+    дописывается в JSONL манифест, прерванный прогон продолжается с
+    необработанных файлов.
+    """
+
+    def __init__(self, service: OpenAIService, manifest_path: Path, output_dir: Optional[Path],
+                 concurrency: Dict[str, int], deadline: float):
+        self._service = service
+        self._manifest_path = manifest_path
+        self._output_dir = output_dir
+        self._concurrency = concurrency
+        self._deadline = deadline
+        self._extension = get_tts_profile()['extension']
+        self.processed = 0
+        self.failed = 0
+
+    async def _transcribe(self, item: Dict[str, Any]) -> None:
+
+        data = await asyncio.to_thread(Path(item["path"]).read_bytes)
+        buffer = io.BytesIO(data)
+        buffer.name = Path(item["path"]).name
+
+        segments = await VoiceService.preprocess_audio(buffer)
+        if segments is None:
+            item["status"] = STATUS_NO_SPEECH
+            return
+        item["transcript"] = await self._service.transcribe_segments(segments, Deadline(self._deadline))
+        if not item["transcript"].strip():
+            item["status"] = STATUS_NO_SPEECH
+
+    async def _answer(self, item: Dict[str, Any]) -> None:
+
+        response, thread_id, metadata = await self._service.get_assistant_response(
+            item["transcript"], deadline=Deadline(self._deadline)
+        )
+        item["response"] = response
+        item["thread_id"] = thread_id
+        item["citations"] = len(metadata.get('file_citations', []))
+
+    async def _synthesize(self, item: Dict[str, Any]) -> None:
+
+        output_path = self._output_dir / f"response_{Path(item['file']).stem}.{self._extension}"
+        await self._service.text_to_speech(item["response"], str(output_path), deadline=Deadline(self._deadline))
+        item["audio"] = str(output_path)
+
+    async def _worker(self, name: str, handler: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue) -> None:
+
+        while True:
+            item = await inbox.get()
+            if item is None:
+                return
+            if "status" not in item:
+                started = time.perf_counter()
+                try:
+                    await handler(item)
+                except Exception as e:
+                    logger.error(f" {item['file']}: ошибка этапа {name}: {e}")
+                    item.update(status=STATUS_ERROR, stage=name, error=str(e))
+                item["seconds"][name] = round(time.perf_counter() - started, 3)
+            await outbox.put(item)
+
+    async def _stage(self, name: str, handler: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue,
+                     downstream_workers: int) -> None:
+
+        await asyncio.gather(*[
+            self._worker(name, handler, inbox, outbox)
+            for _ in range(self._concurrency[name])
+        ])
+        for _ in range(downstream_workers):
+            await outbox.put(None)
+
+    async def _write_results(self, inbox: asyncio.Queue, total: int, started: float) -> None:
+
+        with open(self._manifest_path, "a", encoding="utf-8") as manifest:
+            while True:
+                item = await inbox.get()
+                if item is None:
+                    return
+
+                item.setdefault("status", STATUS_OK)
+                item.pop("path")
+                item["finished_at"] = time.time()
+                manifest.write(json.dumps(item, ensure_ascii=False) + "\n")
+                manifest.flush()
+
+                self.processed += 1
+                if item["status"] == STATUS_ERROR:
+                    self.failed += 1
+                rate = self.processed / max(time.perf_counter() - started, 1e-9) * 60
+                print(f" [{self.processed}/{total}] {item['file']}: {item['status']} ({rate:.1f} файлов/мин)")
+
+    async def run(self, files: List[Dict[str, Any]]) -> float:
+        """Обработка файлов; возвращает длительность прогона в секундах"""
+        stages = [("stt", self._transcribe), ("assistant", self._answer)]
+        if self._output_dir is not None:
+            self._output_dir.mkdir(parents=True, exist_ok=True)
+            stages.append(("tts", self._synthesize))
+
+        queues = [asyncio.Queue(maxsize=self._concurrency[name] * 2) for name, _ in stages]
+        results: asyncio.Queue = asyncio.Queue()
+        started = time.perf_counter()
+
+        async def produce() -> None:
+            for item in files:
+                await queues[0].put(item)
+            for _ in range(self._concurrency[stages[0][0]]):
+                await queues[0].put(None)
+
+        tasks = [produce(), self._write_results(results, len(files), started)]
+        for index, (name, handler) in enumerate(stages):
+            last = index == len(stages) - 1
+            outbox = results if last else queues[index + 1]
+            downstream = 1 if last else self._concurrency[stages[index + 1][0]]
+            tasks.append(self._stage(name, handler, queues[index], outbox, downstream))
+
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+def collect_files(directory: Path, pattern: str, manifest: Dict[str, Dict[str, Any]], limit: Optional[int]) -> List[Dict[str, Any]]:
+
+    files = []
+    skipped = 0
+    for path in sorted(directory.glob(pattern)):
+        if not path.is_file():
+            continue
+        key = str(path.relative_to(directory))
+        signature = file_signature(path)
+        if is_done(manifest.get(key), signature):
+            skipped += 1
+            continue
+        files.append({"file": key, "path": str(path), **signature, "seconds": {}})
+        if limit is not None and len(files) >= limit:
+            break
+
+    if skipped:
+        print(f" Пропущено уже обработанных файлов: {skipped}")
+    return files
+
+async def create_service() -> OpenAIService:
+    """Сервис OpenAI с локальным индексом документов, как у бота, но без кэшей Redis"""
+    retrieval_index = None
+    if settings.local_retrieval_enabled:
+        from services.retrieval import build_retrieval_index
+        try:
+            retrieval_index = await asyncio.to_thread(build_retrieval_index)
+        except Exception as e:
+            logger.error(f" Ошибка построения локального индекса: {e}")
+    return OpenAIService(client=create_openai_client(), retrieval_index=retrieval_index)
+
+async def run_batch(args: argparse.Namespace) -> None:
+
+    directory = Path(args.directory)
+    manifest_path = Path(args.manifest or directory / "batch_manifest.jsonl")
+    files = collect_files(directory, args.pattern, load_manifest(manifest_path), args.limit)
+    if not files:
+        print(" Нет файлов для обработки")
+        return
+
+    print(f" Файлов к обработке: {len(files)}, манифест: {manifest_path}")
+    service = await create_service()
+    pipeline = BatchPipeline(
+        service,
+        manifest_path,
+        None if args.no_tts else Path(args.output_dir or directory / "batch_output"),
+        concurrency={"stt": args.stt_concurrency, "assistant": args.assistant_concurrency, "tts": args.tts_concurrency},
+        deadline=args.deadline
+    )
+    try:
+        elapsed = await pipeline.run(files)
+    finally:
+        await service.close()
+
+    print(
+        f"\n Обработано {pipeline.processed} файлов за {elapsed:.1f} с "
+        f"({pipeline.processed / max(elapsed, 1e-9) * 60:.1f} файлов/мин), ошибок: {pipeline.failed}"
+    )
+    if pipeline.failed:
+        print(" Файлы с ошибками будут обработаны повторно при следующем запуске")
+
+def parse_args() -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(description="Пакетная обработка архива голосовых: транскрибация, ответ ассистента и озвучка")
+    parser.add_argument("directory", help="Каталог с аудио файлами")
+    parser.add_argument("--pattern", default="voice_*.ogg", help="Шаблон имен файлов")
+    parser.add_argument("--manifest", help="JSONL манифест результатов (по умолчанию в каталоге входных файлов)")
+    parser.add_argument("--output-dir", help="Каталог для аудио ответов")
+    parser.add_argument("--no-tts", action="store_true", help="Не озвучивать ответы")
+    parser.add_argument("--stt-concurrency", type=int, default=8)
+    parser.add_argument("--assistant-concurrency", type=int, default=4)
+    parser.add_argument("--tts-concurrency", type=int, default=4)
+    parser.add_argument("--deadline", type=float, default=settings.message_deadline, help="Срок обработки одного этапа, с")
+    parser.add_argument("--limit", type=int, help="Обработать не больше N файлов")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stdout)
+    try:
+        asyncio.run(run_batch(args))
+    except KeyboardInterrupt:
+        print("\n Прервано; обработанные файлы сохранены в манифесте")
+
+if __name__ == "__main__":
+    main()
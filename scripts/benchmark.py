@@ -0,0 +1,555 @@
+import sys
+import os
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import resource
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("ASSISTANT_ID", "asst_benchmark")
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from sqlalchemy.ext.asyncio import create_async_engine
+from core.config import settings
+from database.history import HistoryWriter
+from database.thread_registry import ThreadRegistry
+from handlers.voice_handler import handle_voice_message, handle_text_message
+from services.metrics import metrics, Histogram
+from services.openai_service import OpenAIService, create_openai_client
+from services.scheduler import PipelineScheduler
+from services.transcription_cache import TranscriptionCache
+from services.telegram_limiter import TelegramRateLimiter
+
+ANSWER_SENTENCES = [
+    "Тревожность - это естественная реакция организма на неопределенность.",
+    "Попробуйте медленно вдохнуть на четыре счета и так же медленно выдохнуть.",
+    "Полезно заметить, какие мысли усиливают беспокойство, и записать их.",
+    "Регулярный сон и физическая активность заметно снижают общий уровень тревоги.",
+    "Если тревога мешает повседневной жизни, стоит обратиться к специалисту.",
+]
+
+class Latency:
+    """Задержка с логнормальным распределением вокруг медианы"""
+
+    def __init__(self, median: float, sigma: float):
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * random.lognormvariate(0, self.sigma)
+
+class RecordingHistogram(Histogram):
+    """Гистограмма, дополнительно хранящая исходные значения для точных перцентилей"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.samples: Dict[str, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        super().observe(value, **labels)
+        self.samples.setdefault(labels.get("stage", ""), []).append(value)
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+    return {'count': len(ordered), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+class FakeTelegram:
+    """Локальная замена Bot API: getFile, загрузка файлов, отправка и редактирование сообщений"""
+
+    def __init__(self, latency: Latency, voice_bytes: int):
+        self._latency = latency
+        self._voice = os.urandom(voice_bytes)
+        self._message_ids = itertools.count(1_000_000)
+        self.calls: Dict[str, int] = {}
+
+    def app(self) -> web.Application:
+
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._handle_file)
+        return app
+
+    def _message(self, chat_id: int, **fields: Any) -> Dict[str, Any]:
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            **fields
+        }
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        data = await request.post()
+        await asyncio.sleep(self._latency.sample())
+
+        chat_id = int(data.get("chat_id", 0) or 0)
+        if method == "getFile":
+            result = {
+                'file_id': data["file_id"],
+                'file_unique_id': data["file_id"],
+                'file_size': len(self._voice),
+                'file_path': f"voice/{data['file_id']}.oga"
+            }
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id, text=data.get("text", ""))
+        elif method == "sendVoice":
+            result = self._message(chat_id, voice={
+                'file_id': f"sent_{next(self._message_ids)}",
+                'file_unique_id': f"sent_{next(self._message_ids)}",
+                'duration': 5
+            })
+        else:
+            result = True
+
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _handle_file(self, request: web.Request) -> web.Response:
+
+        self.calls["downloadFile"] = self.calls.get("downloadFile", 0) + 1
+        await asyncio.sleep(self._latency.sample())
+        return web.Response(body=self._voice, content_type="audio/ogg")
+
+class FakeOpenAI:
+    """Локальная замена OpenAI API: транскрибация, треды, runs (поток и опрос), сообщения, chat completions, синтез речи"""
+
+    def __init__(self, stt: Latency, run: Latency, tts: Latency, error_rate: float, answer_chars: int):
+        self._stt = stt
+        self._run = run
+        self._tts = tts
+        self._error_rate = error_rate
+        self._answer = self._build_answer(answer_chars)
+        self._ids = itertools.count(1)
+        self._threads: Dict[str, List[Dict[str, Any]]] = {}
+        self._runs: Dict[str, Dict[str, Any]] = {}
+        self.calls: Dict[str, int] = {}
+
+    @staticmethod
+    def _build_answer(chars: int) -> str:
+
+        parts = []
+        for sentence in itertools.cycle(ANSWER_SENTENCES):
+            if sum(len(p) + 1 for p in parts) >= chars:
+                break
+            parts.append(sentence)
+        return " ".join(parts)
+
+    def app(self) -> web.Application:
+
+        app = web.Application(client_max_size=64 * 1024 * 1024, middlewares=[self._faults])
+        app.router.add_post("/v1/audio/transcriptions", self._transcribe)
+        app.router.add_post("/v1/audio/speech", self._speech)
+        app.router.add_post("/v1/threads", self._create_thread)
+        app.router.add_post("/v1/threads/{thread_id}/messages", self._create_message)
+        app.router.add_get("/v1/threads/{thread_id}/messages", self._list_messages)
+        app.router.add_post("/v1/threads/{thread_id}/runs", self._create_run)
+        app.router.add_get("/v1/threads/{thread_id}/runs/{run_id}", self._retrieve_run)
+        app.router.add_post("/v1/chat/completions", self._chat_completion)
+        return app
+
+    @web.middleware
+    async def _faults(self, request: web.Request, handler) -> web.StreamResponse:
+
+        name = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if random.random() < self._error_rate:
+            return web.json_response(
+                {'error': {'message': "Смоделированная ошибка сервера", 'type': "server_error"}},
+                status=500
+            )
+        return await handler(request)
+
+    def _id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids)}"
+
+    def _message(self, thread_id: str, role: str, text: str, run_id: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            'id': self._id("msg"),
+            'object': "thread.message",
+            'created_at': int(time.time()),
+            'thread_id': thread_id,
+            'role': role,
+            'status': "completed",
+            'content': [{'type': "text", 'text': {'value': text, 'annotations': []}}],
+            'assistant_id': settings.assistant_id if role == "assistant" else None,
+            'run_id': run_id,
+            'attachments': [],
+            'metadata': {}
+        }
+
+    def _run_object(self, thread_id: str, run: Dict[str, Any], status: str) -> Dict[str, Any]:
+        now = int(time.time())
+        return {
+            'id': run['id'],
+            'object': "thread.run",
+            'created_at': run['created_at'],
+            'started_at': run['created_at'] if status != "queued" else None,
+            'completed_at': now if status == "completed" else None,
+            'thread_id': thread_id,
+            'assistant_id': settings.assistant_id,
+            'status': status,
+            'model': "gpt-4o-mini",
+            'instructions': "",
+            'tools': [],
+            'metadata': {},
+            'parallel_tool_calls': True
+        }
+
+    async def _transcribe(self, request: web.Request) -> web.Response:
+
+        await request.read()
+        await asyncio.sleep(self._stt.sample())
+        return web.Response(text=f"Как справиться с тревожностью? Вопрос {next(self._ids)}")
+
+    async def _speech(self, request: web.Request) -> web.StreamResponse:
+
+        body = await request.json()
+        await asyncio.sleep(self._tts.sample())
+        return web.Response(body=os.urandom(250 * len(body.get("input", ""))), content_type="audio/ogg")
+
+    async def _create_thread(self, request: web.Request) -> web.Response:
+
+        body = await request.json()
+        thread_id = self._id("thread")
+        self._threads[thread_id] = [
+            self._message(thread_id, "user", m['content']) for m in body.get("messages", [])
+        ]
+        return web.json_response({'id': thread_id, 'object': "thread", 'created_at': int(time.time()), 'metadata': {}})
+
+    async def _create_message(self, request: web.Request) -> web.Response:
+
+        thread_id = request.match_info["thread_id"]
+        if thread_id not in self._threads:
+            return web.json_response({'error': {'message': "No thread found", 'type': "invalid_request_error"}}, status=404)
+        body = await request.json()
+        message = self._message(thread_id, "user", body["content"])
+        self._threads[thread_id].append(message)
+        return web.json_response(message)
+
+    async def _list_messages(self, request: web.Request) -> web.Response:
+
+        thread_id = request.match_info["thread_id"]
+        run_id = request.query.get("run_id")
+        messages = [m for m in reversed(self._threads.get(thread_id, [])) if not run_id or m['run_id'] == run_id]
+        messages = messages[:int(request.query.get("limit", 20))]
+        return web.json_response({'object': "list", 'data': messages, 'has_more': False})
+
+    async def _create_run(self, request: web.Request) -> web.StreamResponse:
+
+        thread_id = request.match_info["thread_id"]
+        body = await request.json()
+        duration = self._run.sample()
+        run = {
+            'id': self._id("run"),
+            'created_at': int(time.time()),
+            'started': time.monotonic(),
+            'queued_for': duration * 0.3,
+            'duration': duration
+        }
+        self._runs[run['id']] = run
+
+        if not body.get("stream"):
+            return web.json_response(self._run_object(thread_id, run, "queued"))
+        return await self._stream_run(request, thread_id, run)
+
+    async def _retrieve_run(self, request: web.Request) -> web.Response:
+
+        thread_id = request.match_info["thread_id"]
+        run = self._runs[request.match_info["run_id"]]
+        elapsed = time.monotonic() - run['started']
+        if elapsed < run['queued_for']:
+            status = "queued"
+        elif elapsed < run['duration']:
+            status = "in_progress"
+        else:
+            status = "completed"
+            if not run.get('message'):
+                run['message'] = self._message(thread_id, "assistant", self._answer, run['id'])
+                self._threads[thread_id].append(run['message'])
+        return web.json_response(self._run_object(thread_id, run, status))
+
+    async def _stream_run(self, request: web.Request, thread_id: str, run: Dict[str, Any]) -> web.StreamResponse:
+
+        response = web.StreamResponse(headers={'Content-Type': "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(event: str, data: Any) -> None:
+            payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+            await response.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+
+        await send("thread.run.created", self._run_object(thread_id, run, "queued"))
+        await asyncio.sleep(run['queued_for'])
+        await send("thread.run.in_progress", self._run_object(thread_id, run, "in_progress"))
+
+        message = self._message(thread_id, "assistant", self._answer, run['id'])
+        await send("thread.message.created", {**message, 'status': "in_progress", 'content': []})
+
+        words = self._answer.split(" ")
+        step = (run['duration'] - run['queued_for']) / max(len(words), 1)
+        for index, word in enumerate(words):
+            await asyncio.sleep(step)
+            value = word if index == 0 else f" {word}"
+            await send("thread.message.delta", {
+                'id': message['id'],
+                'object': "thread.message.delta",
+                'delta': {'content': [{'index': 0, 'type': "text", 'text': {'value': value, 'annotations': []}}]}
+            })
+
+        self._threads[thread_id].append(message)
+        await send("thread.message.completed", message)
+        await send("thread.run.completed", self._run_object(thread_id, run, "completed"))
+        await send("done", "[DONE]")
+        await response.write_eof()
+        return response
+
+    async def _chat_completion(self, request: web.Request) -> web.StreamResponse:
+        """Потоковый ответ без очереди run: генерация занимает ту же долю, что и в потоке run"""
+        await request.json()
+        duration = self._run.sample() * 0.7
+        completion_id = self._id("chatcmpl")
+
+        response = web.StreamResponse(headers={'Content-Type': "text/event-stream"})
+        await response.prepare(request)
+
+        words = self._answer.split(" ")
+        step = duration / max(len(words), 1)
+        for index, word in enumerate(words):
+            await asyncio.sleep(step)
+            chunk = {
+                'id': completion_id,
+                'object': "chat.completion.chunk",
+                'created': int(time.time()),
+                'model': "gpt-4o-mini",
+                'choices': [{'index': 0, 'delta': {'content': word if index == 0 else f" {word}"}, 'finish_reason': None}]
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+async def start_server(app: web.Application) -> tuple[web.AppRunner, str]:
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+def open_fds() -> Optional[int]:
+
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except FileNotFoundError:
+        return None
+
+def peak_rss_mb() -> float:
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """Прогон N пользователей через обработчики с локальными заменами Telegram и OpenAI"""
+    random.seed(args.seed)
+    stage_samples = RecordingHistogram("bot_stage_duration_seconds", "Длительность этапов обработки", ("stage",))
+    metrics.stage_seconds = stage_samples
+
+    telegram = FakeTelegram(Latency(args.telegram_latency, args.jitter), args.voice_bytes)
+    fake_openai = FakeOpenAI(
+        stt=Latency(args.stt_latency, args.jitter),
+        run=Latency(args.run_latency, args.jitter),
+        tts=Latency(args.tts_latency, args.jitter),
+        error_rate=args.error_rate,
+        answer_chars=args.answer_chars
+    )
+    telegram_runner, telegram_url = await start_server(telegram.app())
+    openai_runner, openai_url = await start_server(fake_openai.app())
+
+    os.environ["OPENAI_BASE_URL"] = f"{openai_url}/v1"
+    settings.assistant_streaming = not args.polling
+    settings.answer_engine = args.engine
+    bot = Bot(
+        token=os.environ["BOT_TOKEN"],
+        session=AiohttpSession(api=TelegramAPIServer.from_base(telegram_url)),
+        default=DefaultBotProperties(parse_mode="HTML")
+    )
+    telegram_limiter = TelegramRateLimiter()
+    bot.session.middleware(telegram_limiter)
+    thread_registry = ThreadRegistry()
+    openai_service = OpenAIService(client=create_openai_client(), thread_registry=thread_registry)
+    transcription_cache = TranscriptionCache()
+    scheduler = PipelineScheduler(max_concurrent=args.max_concurrent)
+    history_writer = HistoryWriter(create_async_engine("sqlite+aiosqlite://"))
+    await history_writer.start()
+
+    latencies: Dict[str, List[float]] = {'voice': [], 'text': []}
+    message_ids = itertools.count(1)
+    peak_fds = open_fds() or 0
+    sampling = True
+
+    async def sample_resources():
+        nonlocal peak_fds
+        while sampling:
+            peak_fds = max(peak_fds, open_fds() or 0)
+            await asyncio.sleep(0.1)
+
+    async def simulate_user(user_id: int):
+        for _ in range(args.messages):
+            message_id = next(message_ids)
+            payload = {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': "private"},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+            }
+            kind = "voice" if random.random() < args.voice_ratio else "text"
+            if kind == "voice":
+                payload['voice'] = {'file_id': f"voice_{message_id}", 'file_unique_id': f"voice_{message_id}", 'duration': 5}
+            else:
+                payload['text'] = f"Что делать при тревоге? Сообщение {message_id}"
+            message = Message.model_validate(payload).as_(bot)
+
+            started = time.perf_counter()
+            if kind == "voice":
+                await handle_voice_message(message, openai_service, thread_registry, transcription_cache,
+                                           scheduler, history_writer, telegram_limiter)
+            else:
+                await handle_text_message(message, openai_service, thread_registry, scheduler, history_writer,
+                                          telegram_limiter)
+            latencies[kind].append(time.perf_counter() - started)
+
+            await asyncio.sleep(random.uniform(0, args.think_time))
+
+    sampler = asyncio.create_task(sample_resources())
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[simulate_user(user_id) for user_id in range(1, args.users + 1)])
+    finally:
+        duration = time.perf_counter() - started
+        sampling = False
+        await sampler
+        await history_writer.close()
+        await openai_service.close()
+        await bot.session.close()
+        await telegram_runner.cleanup()
+        await openai_runner.cleanup()
+
+    total = sum(len(v) for v in latencies.values())
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+        'messages': total,
+        'duration_s': round(duration, 2),
+        'throughput_msg_s': round(total / duration, 2) if duration else 0.0,
+        'end_to_end': {kind: percentiles(values) for kind, values in latencies.items()},
+        'stages': {stage: percentiles(values) for stage, values in sorted(stage_samples.samples.items())},
+        'errors': {f"{stage}:{error}": count for (stage, error), count in metrics.stage_errors._values.items()},
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_open_fds': peak_fds,
+        'telegram_calls': telegram.calls,
+        'openai_calls': fake_openai.calls
+    }
+
+def print_report(result: Dict[str, Any]) -> None:
+
+    print(f"\n Сообщений: {result['messages']} за {result['duration_s']} с, {result['throughput_msg_s']} сообщ/с")
+    print(f" Пиковый RSS: {result['peak_rss_mb']} МБ, открытых дескрипторов: {result['peak_open_fds']}")
+    print(f"\n {'метрика':<28}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}")
+    rows = [(f"e2e:{kind}", stats) for kind, stats in result['end_to_end'].items()]
+    rows += [(f"stage:{stage}", stats) for stage, stats in result['stages'].items()]
+    for name, stats in rows:
+        if not stats['count']:
+            continue
+        print(f" {name:<28}{stats['count']:>7}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}")
+    if result['errors']:
+        print(f"\n Ошибки: {result['errors']}")
+
+def compare_baseline(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Список регрессий перцентилей относительно сохраненного прогона"""
+    regressions = []
+    for section in ("end_to_end", "stages"):
+        for name, stats in result[section].items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous or not previous.get('count') or not stats.get('count'):
+                continue
+            for key in ("p50", "p95", "p99"):
+                if previous[key] > 0 and stats[key] > previous[key] * (1 + tolerance):
+                    regressions.append(f"{section}.{name}.{key}: {previous[key]:.3f} -> {stats[key]:.3f}")
+
+    if result['throughput_msg_s'] < baseline.get('throughput_msg_s', 0) * (1 - tolerance):
+        regressions.append(f"throughput_msg_s: {baseline['throughput_msg_s']} -> {result['throughput_msg_s']}")
+    return regressions
+
+def parse_args() -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота с локальными заменами Telegram и OpenAI")
+    parser.add_argument("--users", type=int, default=20, help="Число одновременных пользователей")
+    parser.add_argument("--messages", type=int, default=5, help="Сообщений от каждого пользователя")
+    parser.add_argument("--voice-ratio", type=float, default=0.7, help="Доля голосовых сообщений")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Максимальная пауза между сообщениями, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Медиана задержки Bot API, с")
+    parser.add_argument("--stt-latency", type=float, default=0.8, help="Медиана задержки транскрибации, с")
+    parser.add_argument("--run-latency", type=float, default=2.5, help="Медиана длительности run ассистента, с")
+    parser.add_argument("--tts-latency", type=float, default=0.7, help="Медиана задержки синтеза речи, с")
+    parser.add_argument("--jitter", type=float, default=0.4, help="Сигма логнормального разброса задержек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов OpenAI с ошибкой 500")
+    parser.add_argument("--answer-chars", type=int, default=400, help="Длина ответа ассистента")
+    parser.add_argument("--voice-bytes", type=int, default=20000, help="Размер входящего голосового")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="Лимит планировщика")
+    parser.add_argument("--polling", action="store_true", help="Опрос статуса run вместо потока")
+    parser.add_argument("--engine", choices=("assistants", "chat"), default="assistants", help="Движок ответов")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="Сохранить результат как baseline в JSON")
+    parser.add_argument("--compare", help="Сравнить с baseline из JSON")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Допустимое ухудшение относительно baseline")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stdout)
+
+    result = asyncio.run(run_benchmark(args))
+    print_report(result)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n Baseline сохранен: {args.save}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print("\n Регрессии относительно baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n Регрессий относительно baseline нет")
+
+if __name__ == "__main__":
+    main()
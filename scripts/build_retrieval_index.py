@@ -0,0 +1,27 @@
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from services.retrieval import build_retrieval_index
+
+def main():
+    """Построение локального поискового индекса по документам"""
+    started = time.perf_counter()
+    index = build_retrieval_index()
+    print(f" Индекс готов: {index.size} фрагментов за {time.perf_counter() - started:.2f} с")
+    
+    query = " ".join(sys.argv[1:])
+    if query:
+        started = time.perf_counter()
+        passages = index.search(query)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f" Запрос: {query} ({elapsed_ms:.3f} мс)")
+        for passage in passages:
+            print(f"\n[{passage['score']:.2f}] {passage['source']} — {passage['heading']}")
+            print(passage['text'][:300])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import sys
+import asyncio
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from core.config import settings
+from services.document_service import DocumentService
+
+async def sync_documents():
+    """Синхронизация каталога документов с vector store ассистента"""
+    directory = sys.argv[1] if len(sys.argv) > 1 else str(Path(settings.document_path).parent)
+    
+    service = DocumentService()
+    try:
+        vector_store_id = await service.sync_vector_store(directory, assistant_id=settings.assistant_id)
+    finally:
+        await service.client.close()
+    
+    print(f" Vector store: {vector_store_id}")
+    if vector_store_id != settings.vector_store_id:
+        print(f"\n Добавьте в .env файл:")
+        print(f"VECTOR_STORE_ID={vector_store_id}")
+
+if __name__ == "__main__":
+    asyncio.run(sync_documents())
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, List, AsyncIterator, Deque, Protocol
+from core.config import settings
+from core.exeptions import AssistantError
+from services.metrics import metrics
+from services.openai_service import AnswerEngine, AnswerStream, OpenAIService
+from services.resilience import Deadline
+from services.retrieval import format_context
+
+logger = logging.getLogger(__name__)
+
+SESSION_PREFIX = "chat_"
+
+DEFAULT_INSTRUCTIONS = "Ты голосовой ассистент. Отвечай кратко, по существу и на языке вопроса."
+
+class Retriever(Protocol):
+    """Источник контекста для ответа, например локальный индекс документов"""
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        ...
+
+class ChatSessions:
+    """Окна истории диалогов в памяти процесса.
+
+    Для каждой сессии хранится не больше max_turns последних пар вопрос-ответ,
+    число сессий ограничено max_sessions с вытеснением давно не использованных.
+    """
+
+    def __init__(self, max_turns: Optional[int] = None, max_sessions: Optional[int] = None):
+        self._max_turns = max_turns or settings.chat_history_turns
+        self._max_sessions = max_sessions or settings.chat_max_sessions
+        self._sessions: "OrderedDict[str, Deque[Dict[str, str]]]" = OrderedDict()
+
+    def history(self, session_id: str) -> List[Dict[str, str]]:
+
+        turns = self._sessions.get(session_id)
+        if turns is None:
+            return []
+        self._sessions.move_to_end(session_id)
+        return list(turns)
+
+    def append(self, session_id: str, question: str, answer: str) -> None:
+
+        turns = self._sessions.get(session_id)
+        if turns is None:
+            turns = self._sessions[session_id] = deque(maxlen=self._max_turns * 2)
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        turns.append({"role": "user", "content": question})
+        turns.append({"role": "assistant", "content": answer})
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+class ChatCompletionsEngine(AnswerEngine):
+    """Ответы одним потоковым запросом к Chat Completions.
+
+    История диалога хранится локально окном последних реплик, контекст
+    документов берется из retriever. Идентификатор сессии возвращается
+    вместо треда и сохраняется в реестре тредов так же, как тред
+    Assistants API. История не общая между воркерами и не переживает
+    перезапуск: в этих случаях диалог продолжается без прошлых реплик.
+    """
+
+    name = "chat"
+
+    def __init__(self, service: OpenAIService, retriever: Optional[Retriever] = None,
+                 sessions: Optional[ChatSessions] = None):
+        super().__init__(service)
+        self.retriever = retriever
+        self.sessions = sessions or ChatSessions()
+
+    def instructions(self) -> str:
+        """Системные инструкции: из настроек, иначе из загруженного ассистента"""
+        if settings.chat_instructions:
+            return settings.chat_instructions
+        assistant = self.service.assistant
+        if assistant is not None and assistant.instructions:
+            return assistant.instructions
+        return DEFAULT_INSTRUCTIONS
+
+    def context(self, message: str) -> Optional[str]:
+
+        if self.retriever is None:
+            return None
+        passages = self.retriever.search(message, settings.retrieval_top_k)
+        if not passages:
+            return None
+        logger.info(f" Найдено фрагментов в локальном индексе: {len(passages)}")
+        return f"{settings.retrieval_instructions}\n\n{format_context(passages)}"
+
+    def stream(self, message: str, session_id: Optional[str] = None,
+               deadline: Optional[Deadline] = None) -> AnswerStream:
+        return ChatCompletionStream(self, message, session_id, deadline)
+
+class ChatCompletionStream(AnswerStream):
+    """Потоковый ответ Chat Completions с историей сессии и контекстом документов"""
+
+    api_name = "Chat Completions API"
+
+    def __init__(self, engine: ChatCompletionsEngine, message: str, session_id: Optional[str] = None,
+                 deadline: Optional[Deadline] = None):
+        super().__init__(engine.service, message, session_id, deadline)
+        self._engine = engine
+
+    def _messages(self) -> List[Dict[str, str]]:
+
+        system = self._engine.instructions()
+        context = self._engine.context(self._message)
+        if context:
+            system = f"{system}\n\n{context}"
+        return [
+            {"role": "system", "content": system},
+            *self._engine.sessions.history(self.thread_id),
+            {"role": "user", "content": self._message},
+        ]
+
+    def _ensure_session(self) -> None:
+
+        if not self.thread_id or not self.thread_id.startswith(SESSION_PREFIX):
+            self.thread_id = f"{SESSION_PREFIX}{uuid.uuid4().hex}"
+            logger.info(f" Создана новая сессия: {self.thread_id}")
+
+    async def _seed_conversation(self) -> None:
+
+        self._ensure_session()
+        self._engine.sessions.append(self.thread_id, self._message, self.text)
+
+    async def _generate(self) -> AsyncIterator[str]:
+
+        self._ensure_session()
+        parts = []
+        started = time.perf_counter()
+        stream = await asyncio.wait_for(
+            self._service.client.chat.completions.create(
+                model=settings.chat_model,
+                messages=self._messages(),
+                stream=True
+            ),
+            self._deadline.remaining()
+        )
+        async with stream:
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self._deadline.remaining())
+                except StopAsyncIteration:
+                    break
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not parts:
+                    metrics.stage_seconds.observe(time.perf_counter() - started, stage="assistant_first_token")
+                parts.append(delta)
+                yield delta
+
+        if not parts:
+            raise AssistantError("Модель не вернула ответ")
+
+        self.text = "".join(parts)
+        self._engine.sessions.append(self.thread_id, self._message, self.text)
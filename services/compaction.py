@@ -0,0 +1,214 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Set
+from openai import AsyncOpenAI
+from core.config import settings
+from database.thread_registry import ThreadRegistry
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части разговора:"
+
+SUMMARY_INSTRUCTIONS = (
+    "Сожми диалог пользователя с ассистентом в краткое резюме от третьего лица. "
+    "Сохрани факты о пользователе, его цели, договоренности и открытые вопросы. "
+    "Не добавляй ничего, чего не было в диалоге."
+)
+
+class ThreadStats:
+    """Размер треда, наблюдаемый этим процессом"""
+
+    def __init__(self):
+        self.messages = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.runs = 0
+        self.compactions = 0
+
+    def as_dict(self) -> Dict[str, int]:
+
+        return {
+            "messages": self.messages,
+            "prompt_tokens": self.prompt_tokens,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "runs": self.runs,
+            "compactions": self.compactions,
+        }
+
+class ThreadCompactor:
+    """Ограничение контекста тредов Assistants API.
+
+    Каждый run получает truncation_strategy (последние
+    compaction_last_messages сообщений) и, если задан, max_prompt_tokens.
+    Когда в треде набирается compaction_trigger_messages сообщений, в фоне
+    старые реплики сворачиваются в резюме: создается новый тред из резюме и
+    последних compaction_keep_messages сообщений, и следующие сообщения
+    пользователя идут в него. Если за время сжатия в старый тред добавились
+    сообщения, результат отбрасывается и сжатие повторяется после
+    следующего run.
+
+    Замена треда сжатым хранится в реестре тредов (в Redis, если он
+    доступен) со сроком жизни треда, поэтому ее видят все воркеры и она
+    переживает перезапуск. Число сообщений в треде считается по run,
+    прошедшим через этот процесс, поэтому для треда, начатого до
+    перезапуска или в другом воркере, порог наступает позже.
+    """
+
+    MAX_REPLACEMENTS = 10
+
+    def __init__(self, client: AsyncOpenAI, registry: Optional[ThreadRegistry] = None, max_threads: int = 10000):
+        self._client = client
+        self._registry = registry or ThreadRegistry()
+        self._max_threads = max_threads
+        self._stats: "OrderedDict[str, ThreadStats]" = OrderedDict()
+        self._in_progress: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def run_options(self) -> Dict[str, Any]:
+        """Параметры run, ограничивающие контекст"""
+        options: Dict[str, Any] = {}
+        if settings.compaction_last_messages:
+            options['truncation_strategy'] = {
+                'type': "last_messages",
+                'last_messages': settings.compaction_last_messages
+            }
+        if settings.compaction_max_prompt_tokens:
+            options['max_prompt_tokens'] = settings.compaction_max_prompt_tokens
+        return options
+
+    async def resolve(self, thread_id: Optional[str]) -> Optional[str]:
+        """Актуальный тред: после сжатия - новый тред вместо исходного"""
+        for _ in range(self.MAX_REPLACEMENTS):
+            if not thread_id:
+                break
+            replacement = await self._registry.get_replacement(thread_id)
+            if replacement is None:
+                break
+            thread_id = replacement
+        return thread_id
+
+    def _remember(self, mapping: OrderedDict, key: str, value: Any) -> None:
+
+        mapping[key] = value
+        mapping.move_to_end(key)
+        while len(mapping) > self._max_threads:
+            mapping.popitem(last=False)
+
+    def stats(self, thread_id: str) -> Optional[Dict[str, int]]:
+
+        stats = self._stats.get(thread_id)
+        return stats.as_dict() if stats is not None else None
+
+    def observe(self, run) -> None:
+        """Учет завершенного run и запуск сжатия треда при превышении порога"""
+        stats = self._stats.get(run.thread_id)
+        if stats is None:
+            stats = ThreadStats()
+            self._remember(self._stats, run.thread_id, stats)
+        else:
+            self._stats.move_to_end(run.thread_id)
+
+        stats.runs += 1
+        stats.messages += 2
+        metrics.thread_messages.observe(stats.messages)
+        if run.usage is not None:
+            stats.prompt_tokens = run.usage.prompt_tokens
+            stats.max_prompt_tokens = max(stats.max_prompt_tokens, run.usage.prompt_tokens)
+            metrics.assistant_prompt_tokens.observe(run.usage.prompt_tokens)
+
+        if (
+            settings.compaction_enabled
+            and run.status == "completed"
+            and stats.messages >= settings.compaction_trigger_messages
+            and run.thread_id not in self._in_progress
+        ):
+            self._in_progress.add(run.thread_id)
+            task = asyncio.create_task(self._compact(run.thread_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _message_text(message) -> str:
+
+        return "\n".join(
+            block.text.value for block in message.content
+            if getattr(block, "type", None) == "text"
+        )
+
+    async def _list_messages(self, thread_id: str) -> List[Any]:
+
+        messages = []
+        async for message in self._client.beta.threads.messages.list(thread_id=thread_id, order="asc", limit=100):
+            messages.append(message)
+        return messages
+
+    async def _summarize(self, messages: List[Any]) -> str:
+
+        dialogue = "\n\n".join(
+            f"{'Пользователь' if message.role == 'user' else 'Ассистент'}: {self._message_text(message)}"
+            for message in messages
+        )
+        completion = await self._client.chat.completions.create(
+            model=settings.chat_model,
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": dialogue},
+            ]
+        )
+        return completion.choices[0].message.content or ""
+
+    async def _latest_message_id(self, thread_id: str) -> Optional[str]:
+
+        page = await self._client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1)
+        return page.data[0].id if page.data else None
+
+    async def _compact(self, thread_id: str) -> None:
+
+        try:
+            messages = await self._list_messages(thread_id)
+            keep = settings.compaction_keep_messages
+            if len(messages) <= keep + 1:
+                metrics.compactions.inc(result="skipped")
+                return
+
+            older, recent = messages[:len(messages) - keep], messages[len(messages) - keep:]
+            summary = await self._summarize(older)
+            if not summary.strip():
+                metrics.compactions.inc(result="failed")
+                return
+
+            if await self._latest_message_id(thread_id) != messages[-1].id:
+                logger.info(f" Сжатие треда {thread_id} отложено: в тред добавлены новые сообщения")
+                metrics.compactions.inc(result="stale")
+                return
+
+            thread = await self._client.beta.threads.create(messages=[
+                {"role": "assistant", "content": f"{SUMMARY_PREFIX}\n{summary}", "metadata": {"summary": "true"}},
+                *[
+                    {"role": message.role, "content": self._message_text(message)}
+                    for message in recent if self._message_text(message)
+                ],
+            ])
+
+            await self._registry.set_replacement(thread_id, thread.id)
+            stats = self._stats.pop(thread_id, None) or ThreadStats()
+            stats.compactions += 1
+            stats.messages = len(recent) + 1
+            self._remember(self._stats, thread.id, stats)
+            metrics.compactions.inc(result="done")
+            logger.info(
+                f" Тред {thread_id} сжат в {thread.id}: {len(older)} сообщений в резюме, "
+                f"{len(recent)} сохранено, последний prompt {stats.prompt_tokens} токенов"
+            )
+        except Exception as e:
+            metrics.compactions.inc(result="failed")
+            logger.warning(f" Ошибка сжатия треда {thread_id}: {e}")
+        finally:
+            self._in_progress.discard(thread_id)
+
+    async def close(self) -> None:
+        """Ожидание начатых сжатий"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,26 +1,34 @@
+import asyncio
+import json
 import logging
-from openai import AsyncOpenAI
+import os
+import time
+from pathlib import Path
+from openai import AsyncOpenAI, NotFoundError
 from core.config import settings
 from core.exeptions import OpenAIServiceError
-import os
+from services.retrieval import file_hash
+from typing import Optional, Dict, Any, List, Tuple
 
 logger = logging.getLogger(__name__)
 
+SUPPORTED_EXTENSIONS = {".docx", ".pdf", ".txt", ".md"}
+
 class DocumentService:
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key)
+    def __init__(self, client: Optional[AsyncOpenAI] = None):
+        self.client = client or AsyncOpenAI(api_key=settings.openai_api_key)
     
     async def create_vector_store(self, file_path: str) -> str:
         """Создание vector store и загрузка документа"""
         try:
             
-            vector_store = await self.client.beta.vector_stores.create(
+            vector_store = await self.client.vector_stores.create(
                 name="Тревожность Документы"
             )
             
            
             with open(file_path, "rb") as file:
-                file_stream = await self.client.beta.vector_stores.file_batches.upload_and_poll(
+                file_stream = await self.client.vector_stores.file_batches.upload_and_poll(
                     vector_store_id=vector_store.id,
                     files=[file]
                 )
@@ -34,6 +42,196 @@ class DocumentService:
             logger.error(f" Ошибка создания vector store: {e}")
             raise OpenAIServiceError(f"Ошибка загрузки документа: {str(e)}")
     
+    async def sync_vector_store(self, directory: str, assistant_id: Optional[str] = None,
+                                manifest_path: Optional[str] = None) -> str:
+        """Инкрементальная синхронизация каталога документов с vector store.
+        
+        Манифест хранит хэш содержимого и file_id каждого загруженного файла.
+        Загружаются только новые и измененные файлы, удаленные убираются из
+        vector store; ассистент обновляется только при смене ID хранилища.
+        Манифест сохраняется сразу после загрузки. Удаление устаревших
+        файлов не прерывает синхронизацию: неудаленные остаются в манифесте
+        и удаляются при следующем запуске. Без манифеста для существующего
+        хранилища его содержимое сверяется с каталогом по имени и размеру.
+        """
+        started = time.perf_counter()
+        manifest_file = Path(manifest_path or settings.document_sync_manifest)
+        
+        try:
+            manifest = await asyncio.to_thread(self._load_manifest, manifest_file)
+            previous_store_id = manifest.get('vector_store_id') or settings.vector_store_id
+            vector_store_id = previous_store_id
+            
+            if not vector_store_id:
+                vector_store = await self.client.vector_stores.create(name="Тревожность Документы")
+                vector_store_id = vector_store.id
+                logger.info(f" Vector store создан: {vector_store_id}")
+            
+            current = await asyncio.to_thread(self._scan_directory, directory)
+            semaphore = asyncio.Semaphore(settings.document_sync_concurrency)
+            
+            synced: Dict[str, Any] = manifest.get('files', {})
+            pending_deletes: List[str] = manifest.get('pending_deletes', [])
+            if manifest.get('vector_store_id') != vector_store_id:
+                synced, pending_deletes = {}, []
+                if vector_store_id == previous_store_id:
+                    synced, pending_deletes = await self._reconcile(semaphore, vector_store_id, directory, current)
+            
+            to_upload = [name for name, digest in current.items() if synced.get(name, {}).get('hash') != digest]
+            
+            uploaded = dict(zip(to_upload, await asyncio.gather(*[
+                self._upload_file(semaphore, vector_store_id, Path(directory) / name)
+                for name in to_upload
+            ])))
+            
+            stale = {
+                name: entry['file_id'] for name, entry in synced.items()
+                if name not in current or uploaded.get(name)
+            }
+            files = {name: entry for name, entry in synced.items() if name not in stale}
+            for name, file_id in uploaded.items():
+                if file_id:
+                    files[name] = {'hash': current[name], 'file_id': file_id}
+            pending_deletes = [*pending_deletes, *stale.values()]
+            
+            await asyncio.to_thread(self._save_manifest, manifest_file, {
+                'vector_store_id': vector_store_id,
+                'files': files,
+                'pending_deletes': pending_deletes
+            })
+            
+            deleted = await asyncio.gather(*[
+                self._delete_file(semaphore, vector_store_id, file_id)
+                for file_id in pending_deletes
+            ])
+            remaining = [file_id for file_id, ok in zip(pending_deletes, deleted) if not ok]
+            if remaining != pending_deletes:
+                await asyncio.to_thread(self._save_manifest, manifest_file, {
+                    'vector_store_id': vector_store_id,
+                    'files': files,
+                    'pending_deletes': remaining
+                })
+            
+            if vector_store_id != previous_store_id and assistant_id:
+                await self.update_assistant_with_files(assistant_id, vector_store_id)
+            
+            logger.info(
+                f" Синхронизация завершена за {time.perf_counter() - started:.2f} с: "
+                f"загружено {sum(1 for f in uploaded.values() if f)}, удалено {len(pending_deletes) - len(remaining)}, "
+                f"отложено удалений {len(remaining)}, без изменений {len(current) - len(to_upload)}"
+            )
+            return vector_store_id
+        
+        except OpenAIServiceError:
+            raise
+        except Exception as e:
+            logger.error(f" Ошибка синхронизации документов: {e}")
+            raise OpenAIServiceError(f"Ошибка синхронизации документов: {str(e)}")
+    
+    async def _reconcile(self, semaphore: asyncio.Semaphore, vector_store_id: str, directory: str,
+                         current: Dict[str, str]) -> Tuple[Dict[str, Any], List[str]]:
+        """Восстановление манифеста по содержимому существующего vector store.
+        
+        Файл хранилища считается загруженным из каталога, если совпадают
+        имя и размер; остальные файлы и дубликаты помечаются к удалению.
+        """
+        store_files = [
+            store_file.id
+            async for store_file in self.client.vector_stores.files.list(vector_store_id=vector_store_id, limit=100)
+        ]
+        
+        async def retrieve(file_id: str):
+            async with semaphore:
+                try:
+                    return await self.client.files.retrieve(file_id)
+                except NotFoundError:
+                    return None
+        
+        synced: Dict[str, Any] = {}
+        orphans: List[str] = []
+        for file_id, file in zip(store_files, await asyncio.gather(*[retrieve(file_id) for file_id in store_files])):
+            name = file.filename if file is not None else None
+            if (
+                name in current
+                and name not in synced
+                and file.bytes == (Path(directory) / name).stat().st_size
+            ):
+                synced[name] = {'hash': current[name], 'file_id': file_id}
+            else:
+                orphans.append(file_id)
+        
+        logger.info(
+            f" Манифест восстановлен по vector store {vector_store_id}: "
+            f"сопоставлено {len(synced)}, к удалению {len(orphans)}"
+        )
+        return synced, orphans
+    
+    @staticmethod
+    def _load_manifest(path: Path) -> Dict[str, Any]:
+        
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    @staticmethod
+    def _save_manifest(path: Path, manifest: Dict[str, Any]) -> None:
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp_path, path)
+    
+    @staticmethod
+    def _scan_directory(directory: str) -> Dict[str, str]:
+        
+        current = {}
+        for path in sorted(Path(directory).iterdir()):
+            if not path.is_file() or path.suffix.lower() not in SUPPORTED_EXTENSIONS or path.name.startswith(("~$", ".")):
+                continue
+            if path.stat().st_size == 0:
+                logger.warning(f" Пустой файл пропущен: {path.name}")
+                continue
+            current[path.name] = file_hash(path)
+        return current
+    
+    async def _upload_file(self, semaphore: asyncio.Semaphore, vector_store_id: str, path: Path) -> Optional[str]:
+        
+        async with semaphore:
+            try:
+                content = await asyncio.to_thread(path.read_bytes)
+                vector_store_file = await self.client.vector_stores.files.upload_and_poll(
+                    vector_store_id=vector_store_id,
+                    file=(path.name, content)
+                )
+            except Exception as e:
+                logger.error(f" Ошибка загрузки файла {path.name}: {e}")
+                return None
+        
+        if vector_store_file.status != "completed":
+            logger.error(f" Файл {path.name} не обработан: {vector_store_file.last_error}")
+            return None
+        
+        logger.info(f" Файл загружен: {path.name} -> {vector_store_file.id}")
+        return vector_store_file.id
+    
+    async def _delete_file(self, semaphore: asyncio.Semaphore, vector_store_id: str, file_id: str) -> bool:
+        
+        async with semaphore:
+            try:
+                try:
+                    await self.client.vector_stores.files.delete(file_id, vector_store_id=vector_store_id)
+                except NotFoundError:
+                    pass
+                await self.client.files.delete(file_id)
+                logger.info(f" Устаревший файл удален: {file_id}")
+            except NotFoundError:
+                logger.info(f" Файл уже удален: {file_id}")
+            except Exception as e:
+                logger.warning(f" Ошибка удаления файла {file_id}, повтор при следующей синхронизации: {e}")
+                return False
+        return True
+    
     async def update_assistant_with_files(self, assistant_id: str, vector_store_id: str):
         """Обновление ассистента с file_search"""
         try:
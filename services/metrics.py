@@ -0,0 +1,215 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Tuple, Callable, Iterator
+from aiohttp import web
+from core.config import settings
+from services.startup import startup
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+BYTES_BUCKETS = (4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> List[str]:
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Gauge:
+    """Мгновенное значение, вычисляемое при каждом чтении"""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def render(self) -> List[str]:
+
+        if self._function is None:
+            return []
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(self._function())}"
+        ]
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин.
+
+    Наблюдение стоит один bisect и несколько операций над списком, поэтому
+    ее можно вызывать на каждом этапе обработки без заметных накладных
+    расходов.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            # счетчики корзин, затем +Inf, сумма
+            series = self._series[key] = [0] * (len(self._buckets) + 2)
+        series[bisect.bisect_left(self._buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self._buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[-2]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class Metrics:
+    """Метрики конвейера обработки сообщений"""
+
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "bot_stage_duration_seconds",
+            "Длительность этапов обработки",
+            ("stage",)
+        )
+        self.stage_errors = Counter(
+            "bot_stage_errors_total",
+            "Ошибки этапов обработки по типу исключения",
+            ("stage", "error")
+        )
+        self.updates = Counter(
+            "bot_updates_total",
+            "Обработанные сообщения по типу содержимого",
+            ("content_type",)
+        )
+        self.handler_seconds = Histogram(
+            "bot_handler_duration_seconds",
+            "Полное время обработки сообщения",
+            ("content_type",)
+        )
+        self.download_bytes = Histogram(
+            "bot_download_bytes",
+            "Размер загруженных из Telegram файлов",
+            buckets=BYTES_BUCKETS
+        )
+        self.assistant_polls = Histogram(
+            "bot_assistant_polls",
+            "Количество опросов статуса на один run ассистента",
+            buckets=COUNT_BUCKETS
+        )
+        self.thread_messages = Histogram(
+            "bot_thread_messages",
+            "Сообщений в треде ассистента после run",
+            buckets=(2, 4, 8, 16, 32, 64, 128)
+        )
+        self.assistant_prompt_tokens = Histogram(
+            "bot_assistant_prompt_tokens",
+            "Токенов контекста на один run ассистента",
+            buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+        )
+        self.compactions = Counter("bot_thread_compactions_total", "Сжатия тредов по результату", ("result",))
+        self.tts_cache_lookups = Counter(
+            "bot_tts_cache_lookups_total",
+            "Обращения к TTS кэшу: аудио и file_id, попадания и промахи",
+            ("kind", "result")
+        )
+        self.hedged_requests = Counter(
+            "bot_hedged_requests_total",
+            "Дублирующие запросы к OpenAI по победителю",
+            ("endpoint", "winner")
+        )
+        self.ready = Gauge("bot_ready", "Процесс прогрет и готов принимать сообщения")
+        self.ready.set_function(lambda: float(startup.ready))
+        self.scheduler_queue = Gauge("bot_scheduler_queue_size", "Задачи в очереди планировщика")
+        self.scheduler_running = Gauge("bot_scheduler_running", "Выполняющиеся задачи планировщика")
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Замер длительности этапа; исключения считаются по типу и пробрасываются"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.stage_errors.inc(stage=name, error=type(e).__name__)
+            raise
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - started, stage=name)
+
+    def render(self) -> str:
+
+        lines: List[str] = []
+        for metric in vars(self).values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+async def handle_ready(request: web.Request) -> web.Response:
+    """Готовность процесса: 200 после прогрева, 503 до него; в теле - длительности этапов запуска"""
+    return web.json_response(startup.as_dict(), status=200 if startup.ready else 503)
+
+async def start_metrics_server(port: Optional[int] = None) -> web.AppRunner:
+    """Локальный HTTP сервер с метриками в текстовом формате Prometheus и проверкой готовности"""
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            text=metrics.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/ready", handle_ready)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    port = port or settings.metrics_port
+    await web.TCPSite(runner, settings.metrics_host, port).start()
+    logger.info(f" Метрики доступны на http://{settings.metrics_host}:{port}/metrics")
+    return runner
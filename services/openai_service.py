@@ -1,18 +1,148 @@
+import aiofiles
+import httpx
 import openai
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from core.config import settings
 from core.exeptions import AssistantError, VoiceProcessingError
+from services.tts_cache import TTSCache
+from services.voice_service import VoiceService
+from services.metrics import metrics
+from services.resilience import Deadline, LatencyTracker, CircuitBreaker, hedged, is_upstream_failure
+from services.compaction import ThreadCompactor
+from database.thread_registry import ThreadRegistry
+import asyncio
+import io
+from abc import ABC, abstractmethod
 import logging
+import itertools
+import math
 import os
-from typing import Optional, Dict, Any
+import re
+import time
+from contextlib import AsyncExitStack, nullcontext
+from pathlib import Path
+from typing import Optional, Dict, Any, AsyncIterator, BinaryIO, Union, Callable, Awaitable, AsyncContextManager, List, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from services.semantic_cache import SemanticCache
+    from services.retrieval import RetrievalIndex
 
 logger = logging.getLogger(__name__)
 
+def create_openai_client() -> AsyncOpenAI:
+    """Создание общего OpenAI клиента с пулом соединений"""
+    http2 = settings.openai_http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning(" Пакет h2 не установлен, HTTP/2 отключен")
+            http2 = False
+    
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=settings.openai_max_connections,
+            max_keepalive_connections=settings.openai_max_keepalive_connections,
+            keepalive_expiry=settings.openai_keepalive_expiry
+        ),
+        timeout=settings.openai_timeout,
+        http2=http2
+    )
+    
+    return AsyncOpenAI(api_key=settings.openai_api_key, http_client=http_client)
+
+TTS_PROFILES: Dict[str, Dict[str, Any]] = {
+    "voice": {
+        "response_format": "opus",
+        "extension": "ogg",
+        "speed": 1.0,
+        "max_bytes": 400 * 1024,
+        "fallback_bitrate": "16k"
+    },
+    "compact": {
+        "response_format": "opus",
+        "extension": "ogg",
+        "speed": 1.1,
+        "max_bytes": 200 * 1024,
+        "fallback_bitrate": "12k"
+    },
+    "mp3": {
+        "response_format": "mp3",
+        "extension": "mp3",
+        "speed": 1.0,
+        "max_bytes": None,
+        "fallback_bitrate": None
+    },
+}
+
+def get_tts_profile(name: Optional[str] = None) -> Dict[str, Any]:
+    """Профиль синтеза речи: формат, скорость и лимит размера, голос и модель из настроек"""
+    name = name or settings.tts_profile
+    if name not in TTS_PROFILES:
+        raise VoiceProcessingError(f"Неизвестный профиль TTS: {name}")
+    
+    profile = {'name': name, 'model': settings.tts_model, 'voice': settings.tts_voice, **TTS_PROFILES[name]}
+    if settings.tts_speed is not None:
+        profile['speed'] = settings.tts_speed
+    return profile
+
+_WORD = re.compile(r"\w+")
+
+def merge_transcripts(parts: List[str], max_overlap_words: int = 12) -> str:
+    """Склейка транскрипций соседних сегментов без повтора слов из перекрытия"""
+    def normalize(word: str) -> str:
+        return "".join(_WORD.findall(word.lower()))
+    
+    merged: List[str] = []
+    for part in parts:
+        words = part.split()
+        if merged and words:
+            tail = [normalize(word) for word in merged[-max_overlap_words:]]
+            head = [normalize(word) for word in words[:max_overlap_words]]
+            for size in range(min(len(tail), len(head)), 0, -1):
+                if tail[-size:] == head[:size]:
+                    words = words[size:]
+                    break
+        merged.extend(words)
+    return " ".join(merged)
+
+async def warm_up_openai(client: AsyncOpenAI, connections: Optional[int] = None) -> Optional[Any]:
+    """Открытие соединений с API (DNS, TLS) и загрузка ассистента до первого сообщения.
+    
+    Параллельные запросы оставляют в пуле клиента несколько прогретых
+    соединений; ассистент загружается хотя бы одним запросом, даже при
+    WARMUP_CONNECTIONS=0. Ошибка прогрева не мешает запуску.
+    """
+    connections = settings.warmup_connections if connections is None else connections
+    results = await asyncio.gather(*[
+        client.beta.assistants.retrieve(settings.assistant_id)
+        for _ in range(max(1, connections))
+    ], return_exceptions=True)
+    
+    for result in results:
+        if not isinstance(result, BaseException):
+            logger.info(f" Ассистент {result.name or result.id} загружен, модель {result.model}")
+            return result
+    
+    logger.warning(f" Не удалось прогреть соединение с OpenAI: {results[0]}")
+    return None
+
 class OpenAIService:
-    def __init__(self):
-        self._client = None
+    def __init__(self, client: Optional[AsyncOpenAI] = None, tts_cache: Optional[TTSCache] = None,
+                 semantic_cache: Optional["SemanticCache"] = None, retrieval_index: Optional["RetrievalIndex"] = None,
+                 assistant: Optional[Any] = None, thread_registry: Optional[ThreadRegistry] = None):
+        self._client = client
+        self.assistant = assistant
+        self._tts_cache = tts_cache
+        self._semantic_cache = semantic_cache
+        self._retrieval_index = retrieval_index
         self._assistant_id = None
+        self._breakers = {name: CircuitBreaker(name) for name in ("stt", "assistant", "tts")}
+        self._latency = {name: LatencyTracker() for name in ("stt", "tts")}
         self._initialize_client()
+        self._compactor = ThreadCompactor(self._client, thread_registry)
+        self._cancellations: Set[asyncio.Task] = set()
+        self._engine = create_answer_engine(self)
     
     def _initialize_client(self):
         
@@ -22,7 +152,8 @@ class OpenAIService:
             if not settings.openai_api_key:
                 raise ValueError("OPENAI_API_KEY не найден в настройках")
             
-            self._client = AsyncOpenAI(api_key=settings.openai_api_key)
+            if self._client is None:
+                self._client = create_openai_client()
             self._assistant_id = settings.assistant_id
             
             logger.info(" OpenAI клиент успешно инициализирован")
@@ -31,144 +162,669 @@ class OpenAIService:
             logger.error(f" Ошибка инициализации OpenAI клиента: {e}")
             raise
     
+    async def close(self):
+        """Закрытие пула соединений OpenAI клиента после завершения фоновых сжатий тредов и отмен run"""
+        await self._compactor.close()
+        if self._cancellations:
+            await asyncio.gather(*self._cancellations, return_exceptions=True)
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            logger.info(" OpenAI клиент закрыт")
+    
     @property
     def client(self):
-<<<<<<< HEAD
-=======
-       
->>>>>>> 4560863a39e9d12190037f91d894d04e36fecce2
         if self._client is None:
             self._initialize_client()
         return self._client
     
     @property
     def assistant_id(self):
-<<<<<<< HEAD
-=======
-        
->>>>>>> 4560863a39e9d12190037f91d894d04e36fecce2
         if self._assistant_id is None:
             self._assistant_id = settings.assistant_id
         return self._assistant_id
     
-    async def transcribe_audio(self, audio_file_path: str) -> str:
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        return self._breakers[endpoint]
+    
+    async def _guarded(self, endpoint: str, factory: Callable[[], Awaitable[Any]], timeout: float,
+                       error_class: type, hedge: bool = False) -> Any:
+        """Вызов OpenAI через размыкатель цепи эндпоинта с таймаутом по бюджету этапа.
+        
+        Идемпотентные вызовы (hedge=True) дублируются, если первый запрос
+        не ответил за заданный перцентиль недавних задержек.
+        """
+        breaker = self._breakers[endpoint]
+        if not breaker.allow():
+            metrics.stage_errors.inc(stage=endpoint, error="CircuitOpen")
+            raise error_class(f"Сервис {endpoint} временно недоступен, попробуйте позже")
+        if timeout <= 0:
+            breaker.release_trial()
+            raise error_class("Превышено время обработки сообщения")
+        
+        tracker = self._latency.get(endpoint)
+        delay = None
+        if hedge and settings.hedging_enabled and tracker is not None:
+            delay = tracker.percentile(settings.hedge_percentile)
         
+        started = time.perf_counter()
         try:
-            logger.info(f" Начинаем транскрибацию файла: {audio_file_path}")
-            
-            if not os.path.exists(audio_file_path):
-                raise VoiceProcessingError(f"Аудио файл не найден: {audio_file_path}")
+            result = await asyncio.wait_for(hedged(factory, delay, endpoint), timeout)
+        except asyncio.CancelledError:
+            breaker.release_trial()
+            raise
+        except Exception as e:
+            if is_upstream_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if isinstance(e, asyncio.TimeoutError):
+                raise error_class(f"Превышено время ожидания {endpoint}: {timeout:.0f} с")
+            raise
+        
+        breaker.record_success()
+        if tracker is not None:
+            tracker.observe(time.perf_counter() - started)
+        return result
+    
+    async def transcribe_audio(self, audio: Union[str, BinaryIO], deadline: Optional[Deadline] = None) -> str:
+        """Транскрибация аудио из пути к файлу или из буфера в памяти"""
+        try:
+            if isinstance(audio, str):
+                logger.info(f" Начинаем транскрибацию файла: {audio}")
+                
+                if not os.path.exists(audio):
+                    raise VoiceProcessingError(f"Аудио файл не найден: {audio}")
+                
+                filename = os.path.basename(audio)
+                data = await asyncio.to_thread(Path(audio).read_bytes)
+            else:
+                filename = os.path.basename(getattr(audio, "name", "") or "voice.ogg")
+                data = audio.getvalue() if isinstance(audio, io.BytesIO) else audio.read()
+                logger.info(f" Начинаем транскрибацию из памяти: {filename}, {len(data)} байт")
             
-            with open(audio_file_path, "rb") as audio_file:
-                transcription = await self.client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    response_format="text"
+            with metrics.stage("stt"):
+                transcription = await self._guarded(
+                    "stt",
+                    lambda: self.client.audio.transcriptions.create(
+                        model="whisper-1",
+                        file=(filename, data),
+                        response_format="text"
+                    ),
+                    (deadline or Deadline()).budget(settings.stt_budget),
+                    VoiceProcessingError,
+                    hedge=True
                 )
             
             logger.info(f" Транскрибация завершена: {transcription[:50]}...")
             return transcription
             
+        except VoiceProcessingError as e:
+            logger.error(f" Ошибка транскрибации: {e}")
+            raise
         except Exception as e:
             logger.error(f" Ошибка транскрибации: {e}")
             raise VoiceProcessingError(f"Ошибка транскрибации: {str(e)}")
     
-<<<<<<< HEAD
-    async def get_assistant_response(self, message: str, thread_id: Optional[str] = None) -> tuple[str, str, Dict[str, Any]]:
-        """Получение ответа от Assistant API с информацией об источниках"""
-=======
-    async def get_assistant_response(self, message: str, thread_id: Optional[str] = None) -> tuple[str, str]:
-       
->>>>>>> 4560863a39e9d12190037f91d894d04e36fecce2
+    async def transcribe_segments(self, segments: List[BinaryIO], deadline: Optional[Deadline] = None,
+                                  on_partial: Optional[Callable[[int, int, str], None]] = None,
+                                  stage: Optional[Callable[[], AsyncContextManager]] = None) -> str:
+        """Параллельная транскрибация сегментов длинной записи со склейкой по порядку.
+        
+        Бюджет STT растет с числом волн параллельных запросов: stt_budget на
+        каждые stt_segment_parallelism сегментов. Срок сообщения продлевается
+        на время дополнительных волн. on_partial(готово, всего, текст)
+        вызывается по завершении каждого сегмента с текстом непрерывного
+        начала записи. stage() занимает слот планировщика на каждый запрос
+        к модели, а не на всю запись.
+        """
+        stage = stage or nullcontext
+        if len(segments) == 1:
+            async with stage():
+                return await self.transcribe_audio(segments[0], deadline)
+        
+        deadline = deadline or Deadline()
+        waves = math.ceil(len(segments) / settings.stt_segment_parallelism)
+        deadline.extend(settings.stt_budget * (waves - 1))
+        stt_deadline = Deadline(deadline.budget(settings.stt_budget * waves))
+        semaphore = asyncio.Semaphore(settings.stt_segment_parallelism)
+        
+        async def transcribe(index: int, segment: BinaryIO) -> tuple[int, str]:
+            async with semaphore, stage():
+                return index, await self.transcribe_audio(segment, stt_deadline)
+        
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(transcribe(index, segment)) for index, segment in enumerate(segments)]
+        parts: List[Optional[str]] = [None] * len(segments)
         try:
-            logger.info(f" Запрос к ассистенту: {message[:50]}...")
-            
-           
-            if not thread_id:
-                thread = await self.client.beta.threads.create()
-                thread_id = thread.id
-                logger.info(f" Создан новый тред: {thread_id}")
-            
-            
-            await self.client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=message
-            )
-            
-            
-            run = await self.client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=self.assistant_id
+            for done, future in enumerate(asyncio.as_completed(tasks), start=1):
+                index, text = await future
+                parts[index] = text
+                if on_partial is not None:
+                    ready = list(itertools.takewhile(lambda part: part is not None, parts))
+                    on_partial(done, len(segments), merge_transcripts(ready))
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        logger.info(f" Транскрибировано сегментов: {len(segments)} за {time.perf_counter() - started:.1f} с")
+        return merge_transcripts(parts)
+    
+    async def get_assistant_response(self, message: str, thread_id: Optional[str] = None,
+                                     deadline: Optional[Deadline] = None) -> tuple[str, str, Dict[str, Any]]:
+        """Получение ответа от движка ответов с информацией об источниках"""
+        stream = self.stream_assistant_response(message, thread_id, deadline)
+        async for _ in stream:
+            pass
+        return stream.result()
+    
+    def stream_assistant_response(self, message: str, thread_id: Optional[str] = None,
+                                  deadline: Optional[Deadline] = None) -> "AnswerStream":
+        """Потоковый ответ выбранного движка: итерация возвращает фрагменты текста"""
+        return self._engine.stream(message, thread_id, deadline)
+    
+    async def thread_stats(self, thread_id: str) -> Optional[Dict[str, int]]:
+        """Размер треда и его сжатия по данным этого процесса"""
+        return self._compactor.stats(await self._compactor.resolve(thread_id))
+    
+    async def _prepare_thread(self, message: str, thread_id: Optional[str]) -> str:
+        
+        thread_id = await self._compactor.resolve(thread_id)
+        if thread_id:
+            try:
+                await self.client.beta.threads.messages.create(
+                    thread_id=thread_id,
+                    role="user",
+                    content=message
+                )
+                return thread_id
+            except openai.NotFoundError:
+                logger.warning(f" Тред {thread_id} не найден, создаем новый")
+            except openai.BadRequestError as e:
+                logger.warning(f" Тред {thread_id} недоступен ({e}), создаем новый")
+        
+        thread = await self.client.beta.threads.create(
+            messages=[{"role": "user", "content": message}]
+        )
+        logger.info(f" Создан новый тред: {thread.id}")
+        return thread.id
+    
+    def _run_options(self, message: str) -> Dict[str, Any]:
+        """Ограничение контекста треда и контекст из локального индекса вместо file_search"""
+        options = self._compactor.run_options()
+        if self._retrieval_index is None:
+            return options
+        
+        passages = self._retrieval_index.search(message, settings.retrieval_top_k)
+        if not passages:
+            return options
+        
+        from services.retrieval import format_context
+        logger.info(f" Найдено фрагментов в локальном индексе: {len(passages)}")
+        return {
+            **options,
+            'tools': [],
+            'additional_instructions': f"{settings.retrieval_instructions}\n\n{format_context(passages)}"
+        }
+    
+    async def _cancel_run(self, thread_id: str, run) -> None:
+        """Отмена run, не завершившегося к сроку, чтобы он не занимал тред"""
+        if run is None or run.status not in ("queued", "in_progress", "requires_action"):
+            return
+        try:
+            await self.client.beta.threads.runs.cancel(run_id=run.id, thread_id=thread_id)
+            logger.warning(f" Процесс ассистента {run.id} отменен по истечении срока")
+        except Exception as e:
+            logger.error(f" Не удалось отменить процесс ассистента {run.id}: {e}")
+    
+    def _cancel_run_later(self, thread_id: str, run) -> None:
+        """Отмена run в фоне: срок ответа уже истек, обработчик ее не ждет"""
+        if run is None or run.status not in ("queued", "in_progress", "requires_action"):
+            return
+        task = asyncio.create_task(self._cancel_run(thread_id, run))
+        self._cancellations.add(task)
+        task.add_done_callback(self._cancellations.discard)
+    
+    async def _within_deadline(self, awaitable: Awaitable[Any], deadline: Deadline,
+                               thread_id: Optional[str] = None, run=None) -> Any:
+        """Запрос к API в пределах срока; по истечении срока начатый run отменяется"""
+        try:
+            return await asyncio.wait_for(awaitable, deadline.remaining())
+        except asyncio.TimeoutError:
+            self._cancel_run_later(thread_id, run)
+            raise
+    
+    async def _poll_run(self, thread_id: str, run_options: Optional[Dict[str, Any]] = None,
+                        deadline: Optional[Deadline] = None, run=None) -> tuple[str, Dict[str, Any]]:
+        """Запуск ассистента с опросом статуса и адаптивной задержкой до истечения срока.
+        
+        Если передан уже созданный run, новый не создается: опрашивается он.
+        Каждый запрос к API ограничен оставшимся сроком.
+        """
+        deadline = deadline or Deadline(settings.assistant_budget)
+        if run is None:
+            run = await self._within_deadline(
+                self.client.beta.threads.runs.create(
+                    thread_id=thread_id,
+                    assistant_id=self.assistant_id,
+                    **(run_options or {})
+                ),
+                deadline
             )
             logger.info(f" Запущен процесс ассистента: {run.id}, статус: {run.status}")
-            
-            
-            while run.status in ["queued", "in_progress"]:
-                import asyncio
-                await asyncio.sleep(1)
-                run = await self.client.beta.threads.runs.retrieve(
+        else:
+            logger.info(f" Опрос начатого процесса ассистента: {run.id}, статус: {run.status}")
+        
+        delay = settings.assistant_poll_initial_delay
+        polls = 0
+        while run.status in ["queued", "in_progress"]:
+            if deadline.expired:
+                self._cancel_run_later(thread_id, run)
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(min(delay, deadline.remaining()))
+            delay = min(delay * settings.assistant_poll_backoff, settings.assistant_poll_max_delay)
+            run = await self._within_deadline(
+                self.client.beta.threads.runs.retrieve(
                     thread_id=thread_id,
                     run_id=run.id
-                )
-                logger.info(f" Статус процесса: {run.status}")
-            if run.status == "completed":
-               
-                messages = await self.client.beta.threads.messages.list(
-                    thread_id=thread_id
-                )
+                ),
+                deadline, thread_id, run
+            )
+            polls += 1
+            logger.info(f" Статус процесса: {run.status}")
+        
+        metrics.assistant_polls.observe(polls)
+        self._observe_run(run)
+        
+        if run.status != "completed":
+            raise AssistantError(f"Процесс ассистента завершился со статусом: {run.status}")
+        
+        messages = await self._within_deadline(
+            self.client.beta.threads.messages.list(
+                thread_id=thread_id,
+                run_id=run.id,
+                order="desc",
+                limit=1
+            ),
+            deadline
+        )
+        
+        assistant_messages = [
+            msg for msg in messages.data 
+            if msg.role == "assistant"
+        ]
+        
+        if not assistant_messages:
+            raise AssistantError("Ассистент не вернул сообщение")
+        
+        return self._parse_assistant_message(assistant_messages[0])
+    
+    def _observe_run(self, run) -> None:
+        """Время ожидания и выполнения run по меткам времени сервера, размер треда"""
+        self._compactor.observe(run)
+        if run.created_at and run.started_at:
+            metrics.stage_seconds.observe(run.started_at - run.created_at, stage="assistant_queued")
+        finished_at = run.completed_at or run.failed_at or run.cancelled_at
+        if run.started_at and finished_at:
+            metrics.stage_seconds.observe(finished_at - run.started_at, stage="assistant_in_progress")
+    
+    @staticmethod
+    def _parse_assistant_message(assistant_message) -> tuple[str, Dict[str, Any]]:
+        
+        response_text = assistant_message.content[0].text.value
+        
+        file_citations = []
+        if hasattr(assistant_message.content[0].text, 'annotations'):
+            for annotation in assistant_message.content[0].text.annotations:
+                if getattr(annotation, 'file_citation', None) is not None:
+                    file_citations.append({
+                        'file_id': annotation.file_citation.file_id,
+                        'quote': getattr(annotation.file_citation, 'quote', None)
+                    })
+        
+        logger.info(f" Получен ответ от ассистента: {response_text[:50]}...")
+        logger.info(f" Использовано цитат из файлов: {len(file_citations)}")
+        
+        return response_text, {'file_citations': file_citations}
+    
+    @property
+    def tts_cache(self) -> Optional[TTSCache]:
+        return self._tts_cache
+    
+    @property
+    def semantic_cache(self) -> Optional["SemanticCache"]:
+        return self._semantic_cache
+    
+    @property
+    def retrieval_index(self) -> Optional["RetrievalIndex"]:
+        return self._retrieval_index
+    
+    @property
+    def engine(self) -> "AnswerEngine":
+        return self._engine
+    
+    @staticmethod
+    def tts_cache_key(text: str, profile: Optional[str] = None) -> str:
+        tts_profile = get_tts_profile(profile)
+        return TTSCache.key(
+            text,
+            tts_profile['voice'],
+            tts_profile['model'],
+            tts_profile['response_format'],
+            str(tts_profile['speed'])
+        )
+    
+    async def text_to_speech(self, text: str, output_path: Optional[str] = None, profile: Optional[str] = None,
+                             deadline: Optional[Deadline] = None) -> bytes:
+        """Синтез речи в память по профилю; при указании output_path аудио также сохраняется на диск"""
+        try:
+            logger.info(f" Создание аудио из текста: {text[:50]}...")
+            
+            tts_profile = get_tts_profile(profile)
+            
+            content = None
+            if self._tts_cache is not None:
+                cache_key = self.tts_cache_key(text, profile)
+                content = await self._tts_cache.get_audio(cache_key)
+                if content is not None:
+                    logger.info(f" Аудио взято из TTS кэша: {len(content)} байт")
+            
+            if content is None:
+                async def synthesize() -> bytes:
+                    buffer = io.BytesIO()
+                    async with self.client.audio.speech.with_streaming_response.create(
+                        model=tts_profile['model'],
+                        voice=tts_profile['voice'],
+                        input=text,
+                        response_format=tts_profile['response_format'],
+                        speed=tts_profile['speed']
+                    ) as response:
+                        async for chunk in response.iter_bytes():
+                            buffer.write(chunk)
+                    return buffer.getvalue()
                 
+                with metrics.stage("tts"):
+                    content = await self._guarded(
+                        "tts",
+                        synthesize,
+                        (deadline or Deadline()).budget(settings.tts_budget),
+                        VoiceProcessingError,
+                        hedge=True
+                    )
                 
-                assistant_messages = [
-                    msg for msg in messages.data 
-                    if msg.role == "assistant"
-                ]
+                max_bytes = tts_profile['max_bytes']
+                if max_bytes and len(content) > max_bytes and tts_profile['fallback_bitrate']:
+                    logger.info(f" Аудио {len(content)} байт больше лимита {max_bytes}, снижаем битрейт")
+                    content = await VoiceService.transcode_opus(content, tts_profile['fallback_bitrate'])
                 
-                if assistant_messages:
-                    latest_message = assistant_messages[0]
-                    response_text = latest_message.content[0].text.value
-                    
-                   
-                    file_citations = []
-                    if hasattr(latest_message.content[0].text, 'annotations'):
-                        for annotation in latest_message.content[0].text.annotations:
-                            if hasattr(annotation, 'file_citation'):
-                                file_citations.append({
-                                    'file_id': annotation.file_citation.file_id,
-                                    'quote': annotation.file_citation.quote
-                                })
-                    
-                    logger.info(f" Получен ответ от ассистента: {response_text[:50]}...")
-                    logger.info(f" Использовано цитат из файлов: {len(file_citations)}")
-                    
-                    return response_text, thread_id, {'file_citations': file_citations}
-                else:
-                    raise AssistantError("Ассистент не вернул сообщение")
+                if self._tts_cache is not None and content:
+                    await self._tts_cache.set_audio(cache_key, content)
+            
+            if output_path:
+                async with aiofiles.open(output_path, 'wb') as f:
+                    await f.write(content)
+                logger.info(f" Аудио файл создан: {output_path}")
             else:
-                raise AssistantError(f"Процесс ассистента завершился со статусом: {run.status}")
+                logger.info(f" Аудио создано в памяти: {len(content)} байт ({tts_profile['response_format']})")
+            
+            return content
             
+        except VoiceProcessingError as e:
+            logger.error(f" Ошибка TTS: {e}")
+            raise
         except Exception as e:
-            logger.error(f" Ошибка Assistant API: {e}")
-            raise AssistantError(f"Ошибка Assistant API: {str(e)}")
+            logger.error(f" Ошибка TTS: {e}")
+            raise VoiceProcessingError(f"Ошибка TTS: {str(e)}")
+
+class AnswerStream(ABC):
+    """Ответ, получаемый по мере генерации.
     
-    async def text_to_speech(self, text: str, output_path: str) -> None:
-        
+    Итерация отдает фрагменты текста, после ее завершения полный ответ,
+    идентификатор треда или сессии и метаданные доступны через result().
+    Семантический кэш, размыкатель цепи, срок ответа и метрики общие для
+    всех движков; сам запрос к модели выполняет _generate().
+    
+    Весь запрос ограничен бюджетом этапа в пределах срока сообщения. При
+    разомкнутой цепи ассистента запрос сразу завершается ошибкой.
+    Семантический кэш используется только для первого сообщения диалога:
+    ответ на уточняющий вопрос зависит от контекста треда. Вопрос и ответ
+    из кэша записываются в новый тред, который возвращается как обычно.
+    """
+    
+    api_name = "Assistant API"
+    
+    def __init__(self, service: OpenAIService, message: str, thread_id: Optional[str] = None,
+                 deadline: Optional[Deadline] = None):
+        self._service = service
+        self._message = message
+        self._deadline = Deadline((deadline or Deadline()).budget(settings.assistant_budget))
+        self.thread_id = thread_id
+        self.text = ""
+        self.metadata: Dict[str, Any] = {'file_citations': []}
+    
+    async def __aiter__(self) -> AsyncIterator[str]:
+        started = time.perf_counter()
         try:
-            logger.info(f" Создание аудио из текста: {text[:50]}...")
+            logger.info(f" Запрос к ассистенту: {self._message[:50]}...")
             
-            response = await self.client.audio.speech.create(
-                model="tts-1",
-                voice="alloy",
-                input=text
-            )
+            semantic_cache = self._service.semantic_cache
+            new_conversation = self.thread_id is None
+            if semantic_cache is not None and new_conversation:
+                cached = await self._lookup_cache(semantic_cache)
+                if cached is not None:
+                    self.text, self.metadata = cached
+                    yield self.text
+                    await self._seed_from_cache()
+                    return
             
+            async for delta in self._guarded():
+                yield delta
             
-            content = response.content
-            with open(output_path, 'wb') as f:
-                f.write(content)
-                
-            logger.info(f" Аудио файл создан: {output_path}")
+            if semantic_cache is not None and new_conversation:
+                await self._store_cache(semantic_cache)
             
+            metrics.stage_seconds.observe(time.perf_counter() - started, stage="assistant")
+            
+        except AssistantError as e:
+            logger.error(f" Ошибка {self.api_name}: {e}")
+            metrics.stage_errors.inc(stage="assistant", error=type(e).__name__)
+            raise
         except Exception as e:
-            logger.error(f" Ошибка TTS: {e}")
-            raise VoiceProcessingError(f"Ошибка TTS: {str(e)}")
+            logger.error(f" Ошибка {self.api_name}: {e}")
+            metrics.stage_errors.inc(stage="assistant", error=type(e).__name__)
+            raise AssistantError(f"Ошибка {self.api_name}: {str(e)}")
+    
+    async def _guarded(self) -> AsyncIterator[str]:
+        """Запрос к модели через размыкатель цепи в пределах срока"""
+        breaker = self._service.breaker("assistant")
+        if not breaker.allow():
+            metrics.stage_errors.inc(stage="assistant", error="CircuitOpen")
+            raise AssistantError("Ассистент временно недоступен, попробуйте позже")
+        
+        try:
+            async for delta in self._generate():
+                yield delta
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.release_trial()
+            raise
+        except Exception as e:
+            if is_upstream_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if isinstance(e, asyncio.TimeoutError):
+                raise AssistantError("Превышено время ожидания ответа ассистента")
+            raise
+        breaker.record_success()
+    
+    @abstractmethod
+    def _generate(self) -> AsyncIterator[str]:
+        """Запрос к модели: отдает фрагменты ответа и заполняет text, thread_id и metadata"""
+    
+    @abstractmethod
+    async def _seed_conversation(self) -> None:
+        """Новый тред или сессия из вопроса и ответа из кэша; заполняет thread_id"""
+    
+    async def _seed_from_cache(self) -> None:
+        """Ответ из кэша становится началом диалога, чтобы уточняющий вопрос шел с контекстом"""
+        try:
+            await self._seed_conversation()
+        except Exception as e:
+            logger.warning(f" Не удалось создать диалог для ответа из кэша: {e}")
+    
+    async def _lookup_cache(self, semantic_cache: "SemanticCache") -> Optional[tuple[str, Dict[str, Any]]]:
+        
+        try:
+            cached = await semantic_cache.lookup(self._message)
+        except Exception as e:
+            logger.warning(f" Ошибка семантического кэша: {e}")
+            return None
+        
+        if cached is not None:
+            logger.info(f" Ответ взят из семантического кэша: {cached[0][:50]}...")
+        return cached
+    
+    async def _store_cache(self, semantic_cache: "SemanticCache") -> None:
+        """Кэшируются только ответы в новом треде, не зависящие от предыдущего контекста"""
+        try:
+            await semantic_cache.store(self._message, self.text, self.metadata)
+        except Exception as e:
+            logger.warning(f" Ошибка записи в семантический кэш: {e}")
+    
+    def result(self) -> tuple[str, str, Dict[str, Any]]:
+        return self.text, self.thread_id, self.metadata
+
+class AssistantResponseStream(AnswerStream):
+    """Ответ через Assistants API: тред, сообщение и run.
+    
+    Фрагменты текста берутся из потока событий run. Если поток недоступен
+    или отключен в настройках, ответ получается опросом статуса и отдается
+    одним фрагментом; run, созданный до обрыва потока, опрашивается, а не
+    запускается повторно. По истечении срока незавершенный run отменяется.
+    """
+    
+    _run = None
+    
+    async def _seed_conversation(self) -> None:
+        
+        thread = await asyncio.wait_for(
+            self._service.client.beta.threads.create(messages=[
+                {"role": "user", "content": self._message},
+                {"role": "assistant", "content": self.text},
+            ]),
+            self._deadline.remaining()
+        )
+        self.thread_id = thread.id
+        logger.info(f" Создан тред для ответа из кэша: {thread.id}")
+    
+    async def _generate(self) -> AsyncIterator[str]:
+        
+        self.thread_id = await asyncio.wait_for(
+            self._service._prepare_thread(self._message, self.thread_id),
+            self._deadline.remaining()
+        )
+        run_options = self._service._run_options(self._message)
+        
+        streamed = False
+        if settings.assistant_streaming:
+            try:
+                async for delta in self._stream_run(run_options):
+                    streamed = True
+                    yield delta
+            except (AssistantError, asyncio.TimeoutError):
+                raise
+            except Exception as e:
+                if streamed:
+                    raise
+                logger.warning(f" Потоковый режим недоступен, переход на опрос: {e}")
+        
+        if not streamed:
+            self.text, self.metadata = await self._service._poll_run(
+                self.thread_id, run_options, self._deadline, run=self._run
+            )
+            yield self.text
+    
+    async def _stream_run(self, run_options: Dict[str, Any]) -> AsyncIterator[str]:
+        
+        parts = []
+        started = time.perf_counter()
+        async with AsyncExitStack() as stack:
+            stream = await self._service._within_deadline(
+                stack.enter_async_context(self._service.client.beta.threads.runs.stream(
+                    thread_id=self.thread_id,
+                    assistant_id=self._service.assistant_id,
+                    **run_options
+                )),
+                self._deadline
+            )
+            deltas = stream.text_deltas.__aiter__()
+            while True:
+                try:
+                    delta = await asyncio.wait_for(deltas.__anext__(), self._deadline.remaining())
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self._service._cancel_run_later(self.thread_id, stream.current_run)
+                    raise
+                except Exception:
+                    self._run = stream.current_run
+                    raise
+                if not parts:
+                    metrics.stage_seconds.observe(time.perf_counter() - started, stage="assistant_first_token")
+                parts.append(delta)
+                yield delta
+            
+            run = await self._service._within_deadline(
+                stream.get_final_run(), self._deadline, self.thread_id, stream.current_run
+            )
+            self._service._observe_run(run)
+            if run.status != "completed":
+                raise AssistantError(f"Процесс ассистента завершился со статусом: {run.status}")
+            
+            assistant_messages = [
+                msg for msg in await stream.get_final_messages()
+                if msg.role == "assistant"
+            ]
+        
+        if assistant_messages:
+            self.text, self.metadata = self._service._parse_assistant_message(assistant_messages[-1])
+        elif parts:
+            self.text = "".join(parts)
+        else:
+            raise AssistantError("Ассистент не вернул сообщение")
+
+class AnswerEngine(ABC):
+    """Способ получения ответа на сообщение пользователя.
+    
+    stream() возвращает AnswerStream; результат у всех движков один:
+    (текст, идентификатор треда или сессии, метаданные).
+    """
+    
+    name = ""
+    
+    def __init__(self, service: OpenAIService):
+        self.service = service
+    
+    @abstractmethod
+    def stream(self, message: str, session_id: Optional[str] = None,
+               deadline: Optional[Deadline] = None) -> AnswerStream:
+        """Ответ на сообщение в рамках треда или сессии session_id"""
+
+class AssistantsEngine(AnswerEngine):
+    """Ответы через Assistants API с тредами на стороне OpenAI"""
+    
+    name = "assistants"
+    
+    def stream(self, message: str, session_id: Optional[str] = None,
+               deadline: Optional[Deadline] = None) -> AnswerStream:
+        return AssistantResponseStream(self.service, message, session_id, deadline)
+
+def create_answer_engine(service: OpenAIService, name: Optional[str] = None) -> AnswerEngine:
+    """Движок ответов по имени из настроек"""
+    name = name or settings.answer_engine
+    if name == AssistantsEngine.name:
+        return AssistantsEngine(service)
+    if name == "chat":
+        from services.chat_engine import ChatCompletionsEngine
+        return ChatCompletionsEngine(service, service.retrieval_index)
+    raise AssistantError(f"Неизвестный движок ответов: {name}")
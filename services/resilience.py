@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional, Callable, Awaitable, TypeVar, Deque, List
+import openai
+from core.config import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+UPSTREAM_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+)
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Ошибки, говорящие о деградации OpenAI, а не о некорректном запросе"""
+    return isinstance(error, UPSTREAM_ERRORS)
+
+class Deadline:
+    """Срок обработки сообщения; бюджет этапа ограничен оставшимся временем"""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self._expires_at = time.monotonic() + (seconds if seconds is not None else settings.message_deadline)
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, stage_budget: float) -> float:
+        return min(stage_budget, self.remaining())
+
+    def extend(self, seconds: float) -> None:
+        """Продление срока, например для длинной записи из нескольких сегментов"""
+        self._expires_at += seconds
+
+class LatencyTracker:
+    """Скользящее окно задержек вызова для выбора момента дублирующего запроса"""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+
+        if len(self._samples) < settings.hedge_min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class CircuitBreaker:
+    """Размыкатель цепи для одного эндпоинта.
+
+    После failure_threshold подряд ошибок upstream (соединение, таймаут,
+    5xx, 429; ошибки содержания ответа не учитываются) цепь размыкается и
+    вызовы сразу отклоняются. Через reset_timeout пропускается один
+    пробный вызов: успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.name = name
+        self._failure_threshold = failure_threshold or settings.breaker_failure_threshold
+        self._reset_timeout = reset_timeout or settings.breaker_reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.state = self.CLOSED
+
+    def allow(self) -> bool:
+
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+
+        if self.state != self.CLOSED:
+            logger.info(f" Цепь {self.name} замкнута, сервис восстановился")
+        self.state = self.CLOSED
+        self._failures = 0
+        self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Освобождение пробного вызова, прерванного без результата"""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self._failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f" Цепь {self.name} разомкнута после {self._failures} ошибок подряд")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+async def hedged(factory: Callable[[], Awaitable[T]], delay: Optional[float], endpoint: str) -> T:
+    """Вызов с дублирующим запросом, если первый не ответил за delay секунд.
+
+    Возвращается первый успешный результат, второй запрос отменяется.
+    Подходит только для идемпотентных вызовов.
+    """
+    tasks: List[asyncio.Task] = [asyncio.ensure_future(factory())]
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                logger.info(f" {endpoint}: нет ответа за {delay:.2f} с, отправлен дублирующий запрос")
+                tasks.append(asyncio.ensure_future(factory()))
+
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if len(tasks) > 1:
+                        metrics.hedged_requests.inc(endpoint=endpoint, winner="primary" if task is tasks[0] else "hedge")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
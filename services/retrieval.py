@@ -0,0 +1,237 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+import numpy as np
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_STEM_LENGTH = 6
+_STOPWORDS = {
+    "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все", "она",
+    "так", "его", "но", "да", "ты", "к", "у", "же", "вы", "за", "бы", "по", "ее", "мне", "есть",
+    "от", "из", "ли", "или", "это", "для", "при", "мы", "их", "the", "a", "an", "of", "and", "to", "in",
+}
+
+def tokenize(text: str) -> List[str]:
+    """Токенизация с усечением слов до префикса вместо полноценного стемминга"""
+    tokens = []
+    for token in _TOKEN.findall(text.lower().replace("ё", "е")):
+        if len(token) < 2 or token in _STOPWORDS:
+            continue
+        tokens.append(token[:_STEM_LENGTH])
+    return tokens
+
+def chunk_docx(path: Path, max_chars: int) -> List[Dict[str, str]]:
+    """Разбиение .docx на фрагменты по заголовкам и абзацам"""
+    from docx import Document
+
+    chunks = []
+    heading = ""
+    buffer: List[str] = []
+
+    def flush():
+        if buffer:
+            chunks.append({'heading': heading, 'text': "\n".join(buffer)})
+            buffer.clear()
+
+    for paragraph in Document(str(path)).paragraphs:
+        text = paragraph.text.strip()
+        if not text:
+            continue
+
+        style = paragraph.style.name if paragraph.style is not None else ""
+        if style.startswith("Heading") or style == "Title":
+            flush()
+            heading = text
+            continue
+
+        if buffer and sum(len(p) for p in buffer) + len(text) > max_chars:
+            flush()
+        buffer.append(text)
+
+    flush()
+    return chunks
+
+def file_hash(path: Path) -> str:
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class RetrievalIndex:
+    """BM25 индекс фрагментов документов.
+
+    Постинги хранятся в формате CSR (offsets, doc_ids, tfs) в файлах .npy и
+    открываются через memory map; словарь и тексты фрагментов лежат в JSON.
+    """
+
+    def __init__(self, index_dir: str, k1: float = 1.5, b: float = 0.75):
+        self._index_dir = Path(index_dir)
+        self._k1 = k1
+        self._b = b
+        self._vocab: Dict[str, int] = {}
+        self._passages: List[Dict[str, str]] = []
+        self._offsets: Optional[np.ndarray] = None
+        self._doc_ids: Optional[np.ndarray] = None
+        self._tfs: Optional[np.ndarray] = None
+        self._idf: Optional[np.ndarray] = None
+        self._length_norm: Optional[np.ndarray] = None
+
+    @property
+    def size(self) -> int:
+        return len(self._passages)
+
+    def _manifest_path(self) -> Path:
+        return self._index_dir / "manifest.json"
+
+    def _load_manifest(self) -> Dict[str, Any]:
+
+        try:
+            return json.loads(self._manifest_path().read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'files': {}}
+
+    def update(self, documents_dir: str) -> bool:
+        """Переиндексация измененных файлов; возвращает True, если индекс перестроен"""
+        manifest = self._load_manifest()
+        previous = manifest.get('files', {})
+        files: Dict[str, Any] = {}
+        changed = False
+
+        for path in sorted(Path(documents_dir).glob("*.docx")):
+            if path.name.startswith("~$"):
+                continue
+            digest = file_hash(path)
+            entry = previous.get(path.name)
+            if entry is None or entry.get('hash') != digest:
+                logger.info(f" Индексация документа: {path.name}")
+                try:
+                    entry = {'hash': digest, 'chunks': chunk_docx(path, settings.retrieval_chunk_chars)}
+                except Exception as e:
+                    logger.warning(f" Документ пропущен, не удалось прочитать {path.name}: {e}")
+                    continue
+                changed = True
+            files[path.name] = entry
+
+        if set(files) != set(previous):
+            changed = True
+
+        if changed or not (self._index_dir / "offsets.npy").exists():
+            self._build(files)
+            manifest = {'files': files}
+            tmp_path = self._manifest_path().with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, self._manifest_path())
+            logger.info(f" Индекс перестроен: {sum(len(f['chunks']) for f in files.values())} фрагментов")
+            changed = True
+
+        self.load()
+        return changed
+
+    def _build(self, files: Dict[str, Any]) -> None:
+
+        self._index_dir.mkdir(parents=True, exist_ok=True)
+
+        passages = []
+        postings: Dict[str, Dict[int, int]] = {}
+        doc_len = []
+        for name, entry in files.items():
+            for chunk in entry['chunks']:
+                doc_id = len(passages)
+                passages.append({'source': name, 'heading': chunk['heading'], 'text': chunk['text']})
+                tokens = tokenize(f"{chunk['heading']} {chunk['text']}")
+                doc_len.append(len(tokens))
+                for token in tokens:
+                    term = postings.setdefault(token, {})
+                    term[doc_id] = term.get(doc_id, 0) + 1
+
+        vocab = {term: i for i, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        doc_ids = []
+        tfs = []
+        for term, term_id in vocab.items():
+            items = sorted(postings[term].items())
+            offsets[term_id + 1] = offsets[term_id] + len(items)
+            doc_ids.extend(doc_id for doc_id, _ in items)
+            tfs.extend(tf for _, tf in items)
+
+        arrays = {
+            'offsets': offsets,
+            'doc_ids': np.asarray(doc_ids, dtype=np.int32),
+            'tfs': np.asarray(tfs, dtype=np.float32),
+            'doc_len': np.asarray(doc_len, dtype=np.float32),
+        }
+        for name, array in arrays.items():
+            np.save(self._index_dir / f"{name}.npy", array)
+
+        (self._index_dir / "vocab.json").write_text(json.dumps(vocab, ensure_ascii=False), encoding="utf-8")
+        (self._index_dir / "passages.json").write_text(json.dumps(passages, ensure_ascii=False), encoding="utf-8")
+
+    def _load_array(self, name: str) -> np.ndarray:
+
+        path = self._index_dir / f"{name}.npy"
+        try:
+            return np.load(path, mmap_mode="r")
+        except ValueError:
+            return np.load(path)
+
+    def load(self) -> None:
+        """Загрузка индекса с диска; массивы постингов отображаются в память"""
+        self._vocab = json.loads((self._index_dir / "vocab.json").read_text(encoding="utf-8"))
+        self._passages = json.loads((self._index_dir / "passages.json").read_text(encoding="utf-8"))
+        self._offsets = self._load_array("offsets")
+        self._doc_ids = self._load_array("doc_ids")
+        self._tfs = self._load_array("tfs")
+        doc_len = np.load(self._index_dir / "doc_len.npy")
+
+        n_docs = len(self._passages)
+        document_frequency = np.diff(self._offsets).astype(np.float64)
+        self._idf = np.log1p((n_docs - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average_length = float(doc_len.mean()) if n_docs else 0.0
+        self._length_norm = (self._k1 * (1 - self._b + self._b * doc_len / (average_length or 1.0))).astype(np.float32)
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """Поиск top-k фрагментов по BM25"""
+        if not self._passages:
+            return []
+
+        scores = np.zeros(len(self._passages), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self._vocab.get(token)
+            if term_id is None:
+                continue
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            doc_ids = self._doc_ids[start:end]
+            tfs = self._tfs[start:end]
+            scores[doc_ids] += self._idf[term_id] * tfs * (self._k1 + 1) / (tfs + self._length_norm[doc_ids])
+
+        candidates = np.flatnonzero(scores)
+        if not candidates.size:
+            return []
+        if candidates.size > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+
+        return [{**self._passages[i], 'score': float(scores[i])} for i in candidates]
+
+def format_context(passages: List[Dict[str, Any]]) -> str:
+    """Форматирование найденных фрагментов для инструкций ассистента"""
+    parts = []
+    for passage in passages:
+        title = f"{passage['source']} — {passage['heading']}" if passage['heading'] else passage['source']
+        parts.append(f"[{title}]\n{passage['text']}")
+    return "\n\n".join(parts)
+
+def build_retrieval_index() -> RetrievalIndex:
+    """Обновление и загрузка индекса по каталогу документов из настроек"""
+    index = RetrievalIndex(settings.retrieval_index_dir)
+    index.update(str(Path(settings.document_path).parent))
+    return index
@@ -0,0 +1,145 @@
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, List, Set, Callable, Awaitable, AsyncIterator
+from core.config import settings
+from core.exeptions import QueueFullError
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_TEXT = 0
+PRIORITY_VOICE = 1
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+class _Job:
+    __slots__ = ("user_id", "priority", "seq", "future", "on_position", "position")
+
+    def __init__(self, user_id: int, priority: int, seq: int, on_position: Optional[PositionCallback]):
+        self.user_id = user_id
+        self.priority = priority
+        self.seq = seq
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.position = 0
+
+class PipelineScheduler:
+    """Допуск и справедливое планирование обработки сообщений.
+
+    Одновременно выполняется не больше max_concurrent задач, у каждого
+    пользователя не больше одной. Ожидающие задачи выбираются по приоритету
+    (текст раньше голоса), затем в порядке поступления. Очередь ограничена
+    общим размером и числом ожидающих задач одного пользователя: при
+    превышении любого лимита новая задача отклоняется с QueueFullError. Отдельные
+    этапы (stt, assistant, tts) ограничиваются собственными семафорами.
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None, max_queue: Optional[int] = None,
+                 stage_limits: Optional[Dict[str, int]] = None, max_per_user: Optional[int] = None):
+        self._max_concurrent = max_concurrent or settings.scheduler_max_concurrent
+        self._max_queue = max_queue or settings.scheduler_max_queue
+        self._max_per_user = max_per_user or settings.scheduler_max_per_user
+        limits = stage_limits or {
+            'stt': settings.scheduler_stt_concurrency,
+            'assistant': settings.scheduler_assistant_concurrency,
+            'tts': settings.scheduler_tts_concurrency,
+        }
+        self._stages = {name: asyncio.Semaphore(limit) for name, limit in limits.items()}
+        self._waiting: List[_Job] = []
+        self._active_users: Set[int] = set()
+        self._running = 0
+        self._seq = itertools.count()
+        self._notifications: Set[asyncio.Task] = set()
+
+    @property
+    def queue_size(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @asynccontextmanager
+    async def job(self, user_id: int, priority: int = PRIORITY_VOICE,
+                  on_position: Optional[PositionCallback] = None) -> AsyncIterator[None]:
+        """Выполнение задачи пользователя после допуска планировщиком"""
+        if len(self._waiting) >= self._max_queue:
+            metrics.stage_errors.inc(stage="queue_wait", error="QueueFullError")
+            raise QueueFullError("Очередь обработки переполнена")
+        if sum(1 for waiting in self._waiting if waiting.user_id == user_id) >= self._max_per_user:
+            metrics.stage_errors.inc(stage="queue_wait", error="UserQueueFullError")
+            raise QueueFullError(f"Слишком много сообщений пользователя {user_id} в очереди")
+
+        started = time.perf_counter()
+        job = _Job(user_id, priority, next(self._seq), on_position)
+        self._waiting.append(job)
+        self._dispatch()
+
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job in self._waiting:
+                self._waiting.remove(job)
+                self._notify_positions()
+            elif job.future.done() and not job.future.cancelled():
+                self._release(job)
+            raise
+        metrics.stage_seconds.observe(time.perf_counter() - started, stage="queue_wait")
+
+        try:
+            yield
+        finally:
+            self._release(job)
+
+    @asynccontextmanager
+    async def stage(self, name: str) -> AsyncIterator[None]:
+        """Ограничение параллелизма отдельного этапа конвейера"""
+        semaphore = self._stages.get(name)
+        if semaphore is None:
+            yield
+            return
+        async with semaphore:
+            yield
+
+    def _release(self, job: _Job) -> None:
+
+        self._running -= 1
+        self._active_users.discard(job.user_id)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+
+        self._waiting.sort(key=lambda j: (j.priority, j.seq))
+        for job in list(self._waiting):
+            if self._running >= self._max_concurrent:
+                break
+            if job.user_id in self._active_users:
+                continue
+            self._waiting.remove(job)
+            self._running += 1
+            self._active_users.add(job.user_id)
+            job.future.set_result(None)
+
+        self._notify_positions()
+
+    def _notify_positions(self) -> None:
+
+        for position, job in enumerate(self._waiting, start=1):
+            if job.position == position or job.on_position is None:
+                job.position = position
+                continue
+            job.position = position
+            task = asyncio.create_task(self._send_position(job.on_position, position))
+            self._notifications.add(task)
+            task.add_done_callback(self._notifications.discard)
+
+    @staticmethod
+    async def _send_position(callback: PositionCallback, position: int) -> None:
+
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.debug(f" Не удалось обновить позицию в очереди: {e}")
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+import numpy as np
+from openai import AsyncOpenAI
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+def normalize_question(text: str) -> str:
+    """Нормализация вопроса: регистр, пунктуация и пробелы"""
+    text = text.lower().replace("ё", "е")
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+def corpus_fingerprint(directory: str) -> str:
+    """Отпечаток набора документов по имени, размеру и времени изменения файлов"""
+    digest = hashlib.sha256()
+    for path in sorted(Path(directory).glob("*.docx")):
+        stat = path.stat()
+        digest.update(f"{path.name}\x00{stat.st_size}\x00{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+class SemanticCache:
+    """Семантический кэш ответов ассистента.
+
+    Вопросы нормализуются и переводятся в эмбеддинги; поиск ближайшего соседа
+    идет по косинусной близости в матрице NumPy фиксированной емкости. Точное
+    совпадение нормализованного текста обслуживается без запроса эмбеддинга.
+    Записи истекают по TTL, при заполнении вытесняется давно не используемая,
+    а изменение набора документов сбрасывает кэш целиком.
+    """
+
+    def __init__(self, client: AsyncOpenAI, threshold: Optional[float] = None, ttl: Optional[int] = None,
+                 capacity: Optional[int] = None, documents_dir: Optional[str] = None):
+        self._client = client
+        self._threshold = threshold or settings.semantic_cache_threshold
+        self._ttl = ttl or settings.semantic_cache_ttl
+        self._capacity = capacity or settings.semantic_cache_capacity
+        self._documents_dir = documents_dir or str(Path(settings.document_path).parent)
+
+        self._vectors: Optional[np.ndarray] = None
+        self._valid = np.zeros(self._capacity, dtype=bool)
+        self._expires_at = np.zeros(self._capacity, dtype=np.float64)
+        self._last_used = np.zeros(self._capacity, dtype=np.float64)
+        self._entries: List[Optional[Tuple[str, str, Dict[str, Any]]]] = [None] * self._capacity
+        self._exact: Dict[str, int] = {}
+        self._pending: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+        self._corpus_version: Optional[str] = None
+        self._corpus_checked_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+
+    async def _embed(self, normalized: str) -> np.ndarray:
+
+        response = await self._client.embeddings.create(
+            model=settings.semantic_cache_embedding_model,
+            input=normalized
+        )
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def refresh_corpus_version(self, force: bool = False) -> None:
+        """Проверка набора документов; при изменении кэш сбрасывается"""
+        now = time.monotonic()
+        if not force and now - self._corpus_checked_at < settings.semantic_cache_corpus_check_interval:
+            return
+        self._corpus_checked_at = now
+
+        version = await asyncio.to_thread(corpus_fingerprint, self._documents_dir)
+        if self._corpus_version is not None and version != self._corpus_version:
+            logger.info(" Набор документов изменился, семантический кэш сброшен")
+            self.invalidate()
+        self._corpus_version = version
+
+    def invalidate(self) -> None:
+
+        self._valid[:] = False
+        self._entries = [None] * self._capacity
+        self._exact.clear()
+        self._pending.clear()
+
+    def _live_mask(self) -> np.ndarray:
+        return self._valid & (self._expires_at > time.time())
+
+    def _hit(self, slot: int) -> Tuple[str, Dict[str, Any]]:
+
+        self._last_used[slot] = time.time()
+        self.hits += 1
+        _, answer, metadata = self._entries[slot]
+        return answer, {**metadata, 'cached': True}
+
+    async def lookup(self, question: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Поиск ответа на близкий вопрос; None при промахе"""
+        await self.refresh_corpus_version()
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+
+        live = self._live_mask()
+        slot = self._exact.get(normalized)
+        if slot is not None and live[slot]:
+            return self._hit(slot)
+
+        if self._vectors is None and not live.any():
+            self.misses += 1
+            return None
+
+        vector = await self._embed(normalized)
+        self._pending[normalized] = vector
+        while len(self._pending) > 256:
+            self._pending.popitem(last=False)
+
+        if self._vectors is not None and live.any():
+            similarities = self._vectors @ vector
+            similarities[~live] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self._threshold:
+                logger.info(f" Семантический кэш: близость {similarities[best]:.3f}")
+                return self._hit(best)
+
+        self.misses += 1
+        return None
+
+    async def store(self, question: str, answer: str, metadata: Dict[str, Any]) -> None:
+        """Сохранение ответа; эмбеддинг берется из предыдущего поиска, если он был"""
+        normalized = normalize_question(question)
+        if not normalized or not answer:
+            return
+
+        vector = self._pending.pop(normalized, None)
+        if vector is None:
+            vector = await self._embed(normalized)
+
+        if self._vectors is None:
+            self._vectors = np.zeros((self._capacity, vector.shape[0]), dtype=np.float32)
+
+        slot = self._exact.get(normalized)
+        if slot is None:
+            live = self._live_mask()
+            free = np.flatnonzero(~live)
+            slot = int(free[0]) if free.size else int(np.argmin(self._last_used))
+            previous = self._entries[slot]
+            if previous is not None:
+                self._exact.pop(previous[0], None)
+
+        now = time.time()
+        self._vectors[slot] = vector
+        self._valid[slot] = True
+        self._expires_at[slot] = now + self._ttl
+        self._last_used[slot] = now
+        self._entries[slot] = (normalized, answer, dict(metadata))
+        self._exact[normalized] = slot
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': int(self._live_mask().sum())
+        }
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Tuple, Union
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SHM_DIRECTORY = Path("/dev/shm")
+
+def spool_directory() -> Path:
+    """Каталог временных файлов; при SPOOL_USE_SHM - в tmpfs, если он доступен"""
+    if settings.spool_use_shm and SHM_DIRECTORY.is_dir() and os.access(SHM_DIRECTORY, os.W_OK):
+        return SHM_DIRECTORY / Path(settings.spool_dir).name
+    return Path(settings.spool_dir)
+
+def unique_path(directory: Path, prefix: str, suffix: str) -> Path:
+    """Уникальное имя файла для одного запроса"""
+    return directory / f"{prefix}_{uuid.uuid4().hex}{suffix}"
+
+class TempSpool:
+    """Фоновая очистка каталога временных файлов.
+
+    Голосовой конвейер работает в памяти, поэтому в каталоге остаются
+    только файлы, записанные save_audio_response, и файлы прошлых версий
+    и падений процесса. janitor периодически удаляет файлы старше ttl.
+    """
+
+    def __init__(self, directory: Optional[Path] = None, ttl: Optional[int] = None):
+        self.directory = directory or spool_directory()
+        self._ttl = ttl or settings.spool_file_ttl
+        self._janitor: Optional[asyncio.Task] = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _cleanup_expired(self) -> Tuple[int, int]:
+
+        removed = 0
+        reclaimed = 0
+        deadline = time.time() - self._ttl
+        for path in self.directory.iterdir():
+            if not path.is_file():
+                continue
+            try:
+                stat = path.stat()
+                if stat.st_mtime > deadline:
+                    continue
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f" Не удалось удалить временный файл {path}: {e}")
+                continue
+            removed += 1
+            reclaimed += stat.st_size
+        return removed, reclaimed
+
+    async def cleanup_expired(self) -> Tuple[int, int]:
+        """Удаление файлов старше ttl; возвращает число файлов и освобожденные байты"""
+        removed, reclaimed = await asyncio.to_thread(self._cleanup_expired)
+        if removed:
+            logger.info(f" Очистка временных файлов: удалено {removed}, освобождено {reclaimed} байт")
+        return removed, reclaimed
+
+    async def _run_janitor(self, interval: float) -> None:
+
+        while True:
+            try:
+                await self.cleanup_expired()
+            except Exception as e:
+                logger.error(f" Ошибка очистки временных файлов: {e}")
+            await asyncio.sleep(interval)
+
+    def start_janitor(self, interval: Optional[float] = None) -> None:
+
+        if self._janitor is None:
+            self._janitor = asyncio.create_task(self._run_janitor(interval or settings.spool_janitor_interval))
+
+    async def close(self) -> None:
+
+        if self._janitor is not None:
+            self._janitor.cancel()
+            try:
+                await self._janitor
+            except asyncio.CancelledError:
+                pass
+            self._janitor = None
+
+def remove_file(path: Optional[Union[str, Path]]) -> None:
+    """Удаление файла; пустой путь и отсутствие файла не считаются ошибкой, остальные ошибки логируются"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f" Не удалось удалить файл {path}: {e}")
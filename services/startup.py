@@ -0,0 +1,53 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Awaitable, TypeVar, Any
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class StartupReport:
+    """Длительности этапов импорта и запуска процесса и признак готовности.
+
+    Модуль импортируется первым и не тянет зависимостей, поэтому отсчет
+    ведется практически от старта интерпретатора. Этапы, выполняемые
+    параллельно, в сумме могут превышать общее время запуска.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+        self.ready_after: float = 0.0
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    async def measure(self, name: str, awaitable: Awaitable[T]) -> T:
+        """Замер этапа, выполняемого параллельно с другими"""
+        with self.phase(name):
+            return await awaitable
+
+    def mark_ready(self) -> None:
+
+        self.ready = True
+        self.ready_after = time.perf_counter() - self.started
+        breakdown = ", ".join(f"{name} {seconds:.2f}" for name, seconds in self.phases.items())
+        logger.info(f" Готов к работе через {self.ready_after:.2f} с после старта ({breakdown})")
+
+    def as_dict(self) -> Dict[str, Any]:
+
+        return {
+            "ready": self.ready,
+            "ready_after": round(self.ready_after, 3),
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+        }
+
+startup = StartupReport()
@@ -0,0 +1,259 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Optional, List, Tuple, Union
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message
+from core.config import settings
+from core.exeptions import UpdateDroppedError
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+NOT_MODIFIED = "message is not modified"
+
+_priority: ContextVar[int] = ContextVar("telegram_request_priority", default=PRIORITY_HIGH)
+_reserved: ContextVar[bool] = ContextVar("telegram_request_reserved", default=False)
+
+class TokenBucket:
+    """Токен-бакет, в котором ожидающие запросы обслуживаются по приоритету.
+
+    Запросы низкого приоритета не забирают последний токен, он остается
+    для ответа. pause() блокирует бакет целиком, например на время
+    retry_after. Запрос с max_wait отказывается сразу, если по текущей
+    очереди токен не освободится за это время.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiters: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._headroom = 1 if capacity >= 2 else 0
+
+    def _refill(self, now: float) -> None:
+
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def _expected_wait(self, position: int, priority: int, now: float) -> float:
+
+        needed = position + 1 + (self._headroom if priority != PRIORITY_HIGH else 0)
+        shortage = needed - self._tokens
+        wait = shortage / self._rate if shortage > 0 else 0.0
+        return max(wait, self._blocked_until - now)
+
+    def pause(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        return not self._waiters and self._tokens >= self._capacity and self._blocked_until <= time.monotonic()
+
+    async def acquire(self, priority: int = PRIORITY_HIGH, max_wait: Optional[float] = None) -> bool:
+        """Получение токена; False, если ожидание превысило бы max_wait"""
+        entry = (priority, next(self._seq))
+        bisect.insort(self._waiters, entry)
+        try:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                position = self._waiters.index(entry)
+                wait = self._expected_wait(position, priority, now)
+                if wait <= 0:
+                    self._tokens -= 1
+                    return True
+                if max_wait is not None and wait > max_wait:
+                    return False
+                await asyncio.sleep(max(wait, 0.01))
+        finally:
+            self._waiters.remove(entry)
+
+class TelegramRateLimiter(BaseRequestMiddleware):
+    """Исходящие запросы Bot API через глобальный и поканальные токен-бакеты.
+
+    Ограничиваются только методы с chat_id (отправка, редактирование,
+    удаление сообщений). Запросы с низким приоритетом (обновления статуса)
+    отбрасываются с UpdateDroppedError, если токена придется ждать дольше
+    telegram_status_max_wait. Ответ 429 обрабатывается здесь же: бакет
+    чата ставится на паузу на retry_after, запрос повторяется; запросы
+    низкого приоритета после 429 не повторяются.
+    """
+
+    def __init__(self, global_rate: Optional[float] = None, chat_rate: Optional[float] = None,
+                 chat_burst: Optional[int] = None, max_chats: int = 10000):
+        self._global_rate = global_rate or settings.telegram_global_rate
+        self._chat_rate = chat_rate or settings.telegram_chat_rate
+        self._chat_burst = chat_burst or settings.telegram_chat_burst
+        self._max_chats = max_chats
+        self._global = TokenBucket(self._global_rate, self._global_rate)
+        self._chats: "OrderedDict[Union[int, str], TokenBucket]" = OrderedDict()
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+            if len(self._chats) > self._max_chats:
+                for stale_id, stale in list(self._chats.items()):
+                    if len(self._chats) <= self._max_chats:
+                        break
+                    if stale.idle:
+                        del self._chats[stale_id]
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def reserve(self, chat_id: Union[int, str], priority: int = PRIORITY_HIGH,
+                      max_wait: Optional[float] = None) -> bool:
+        """Получение токенов чата и глобального бакета до формирования запроса"""
+        if not await self._chat_bucket(chat_id).acquire(priority, max_wait):
+            return False
+        return await self._global.acquire(priority, max_wait)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        priority = _priority.get()
+        max_wait = settings.telegram_status_max_wait if priority == PRIORITY_LOW else None
+        reserved = _reserved.get()
+
+        for attempt in range(settings.telegram_max_retries + 1):
+            if chat_id is not None and not reserved:
+                if not await self.reserve(chat_id, priority, max_wait):
+                    metrics.stage_errors.inc(stage="telegram", error="UpdateDroppedError")
+                    raise UpdateDroppedError(f"Обновление {method.__api_method__} отброшено из-за лимитов")
+            reserved = False
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.stage_errors.inc(stage="telegram", error="TelegramRetryAfter")
+                logger.warning(f" Лимит Telegram для {method.__api_method__} (чат {chat_id}): повтор через {e.retry_after} с")
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self._global
+                bucket.pause(e.retry_after)
+                if priority == PRIORITY_LOW:
+                    raise UpdateDroppedError(f"Обновление {method.__api_method__} отброшено после 429") from e
+                if attempt == settings.telegram_max_retries:
+                    raise
+                if chat_id is None:
+                    await asyncio.sleep(e.retry_after)
+
+class StatusMessage:
+    """Сообщение о ходе обработки с объединением обновлений.
+
+    update() не ждет отправки: в фоне отправляется только последний
+    текст, промежуточные заменяются более новыми, а под нагрузкой
+    обновления отбрасываются. final() и delete() дожидаются текущего
+    обновления и выполняются с высоким приоритетом. Текст отправляется
+    без разметки: в нем вопрос пользователя и ответ ассистента.
+
+    Используется как асинхронный контекстный менеджер: при выходе, в том
+    числе по исключению, фоновые обновления останавливаются.
+    """
+
+    def __init__(self, message: Message, limiter: Optional[TelegramRateLimiter] = None):
+        self.message = message
+        self._limiter = limiter
+        self._pending: Optional[str] = None
+        self._sent_text = message.text
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def __aenter__(self) -> "StatusMessage":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    def update(self, text: str) -> None:
+        """Постановка нового текста статуса; предыдущий неотправленный текст отбрасывается"""
+        if self._closed:
+            return
+        self._pending = text[:TELEGRAM_TEXT_LIMIT]
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+
+        _priority.set(PRIORITY_LOW)
+        while self._pending is not None and not self._closed:
+            if self._limiter is not None:
+                if not await self._limiter.reserve(self.message.chat.id, PRIORITY_LOW, settings.telegram_status_max_wait):
+                    logger.debug(" Обновление статуса отложено из-за лимитов")
+                    await asyncio.sleep(settings.telegram_status_max_wait)
+                    continue
+                _reserved.set(True)
+
+            text, self._pending = self._pending, None
+            if text is None or text == self._sent_text:
+                continue
+            try:
+                await self.message.edit_text(text, parse_mode=None)
+                self._sent_text = text
+            except UpdateDroppedError as e:
+                logger.debug(f" Обновление статуса пропущено: {e}")
+            except TelegramBadRequest as e:
+                if NOT_MODIFIED in e.message:
+                    logger.debug(f" Обновление статуса не изменило сообщение: {e}")
+                else:
+                    logger.warning(f" Ошибка обновления статуса: {e}")
+            except Exception as e:
+                logger.warning(f" Ошибка обновления статуса: {e}")
+            finally:
+                _reserved.set(False)
+
+    async def _close(self) -> None:
+
+        self._closed = True
+        self._pending = None
+        if self._task is not None:
+            await self._task
+
+    async def close(self) -> None:
+        """Остановка фоновых обновлений без изменения текста сообщения"""
+        self._closed = True
+        self._pending = None
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def final(self, text: str) -> None:
+        """Итоговый текст сообщения; отправляется всегда"""
+        await self._close()
+        text = text[:TELEGRAM_TEXT_LIMIT]
+        if text == self._sent_text:
+            return
+        try:
+            await self.message.edit_text(text, parse_mode=None)
+            self._sent_text = text
+        except TelegramBadRequest as e:
+            if NOT_MODIFIED not in e.message:
+                raise
+            logger.debug(f" Итоговое обновление не изменило сообщение: {e}")
+
+    async def delete(self) -> None:
+
+        await self._close()
+        await self.message.delete()
+
+def create_telegram_limiter() -> TelegramRateLimiter:
+    """Лимитер с глобальным лимитом, поделенным между воркерами webhook"""
+    workers = settings.webhook_workers if settings.bot_mode == "webhook" else 1
+    return TelegramRateLimiter(global_rate=settings.telegram_global_rate / max(workers, 1))
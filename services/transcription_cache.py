@@ -0,0 +1,103 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple
+from redis.asyncio import Redis
+from core.config import settings
+from database.redis_storage import connect_redis
+
+logger = logging.getLogger(__name__)
+
+class TranscriptionCache:
+    """Кэш транскрибаций по Telegram file_unique_id.
+
+    Записи хранятся в памяти процесса (LRU с ограничением размера) и, если
+    доступен Redis, дублируются туда с тем же TTL для общих воркеров.
+    Пустые транскрибации не сохраняются: повторная отправка того же файла
+    распознается заново.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, ttl: Optional[int] = None,
+                 max_entries: Optional[int] = None, prefix: str = "transcription"):
+        self._redis = redis
+        self._ttl = ttl or settings.transcription_cache_ttl
+        self._max_entries = max_entries or settings.transcription_cache_max_entries
+        self._prefix = prefix
+        self._local: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, file_unique_id: str) -> str:
+        return f"{self._prefix}:{file_unique_id}"
+
+    def _get_local(self, file_unique_id: str) -> Optional[str]:
+
+        entry = self._local.get(file_unique_id)
+        if entry is None:
+            return None
+        text, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._local[file_unique_id]
+            return None
+        self._local.move_to_end(file_unique_id)
+        return text
+
+    def _set_local(self, file_unique_id: str, text: str, ttl: float) -> None:
+
+        self._local[file_unique_id] = (text, time.monotonic() + ttl)
+        self._local.move_to_end(file_unique_id)
+        while len(self._local) > self._max_entries:
+            self._local.popitem(last=False)
+
+    async def get(self, file_unique_id: str) -> Optional[str]:
+        """Получение транскрибации; промах в памяти проверяется в Redis"""
+        text = self._get_local(file_unique_id)
+
+        if text is None and self._redis is not None:
+            try:
+                key = self._key(file_unique_id)
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.get(key)
+                    pipe.ttl(key)
+                    text, remaining = await pipe.execute()
+                if text is not None:
+                    self._set_local(file_unique_id, text, remaining if remaining > 0 else self._ttl)
+            except Exception as e:
+                logger.warning(f" Ошибка чтения кэша транскрибаций: {e}")
+
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    async def set(self, file_unique_id: str, text: str) -> None:
+
+        if not text.strip():
+            return
+        self._set_local(file_unique_id, text, self._ttl)
+        if self._redis is not None:
+            try:
+                await self._redis.set(self._key(file_unique_id), text, ex=self._ttl)
+            except Exception as e:
+                logger.warning(f" Ошибка записи в кэш транскрибаций: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._local)
+        }
+
+    async def close(self) -> None:
+
+        logger.info(f" Статистика кэша транскрибаций: {self.stats()}")
+        if self._redis is not None:
+            await self._redis.aclose()
+
+async def create_transcription_cache() -> TranscriptionCache:
+    """Кэш транскрибаций в памяти процесса с общим слоем в Redis, если он доступен"""
+    redis = await connect_redis()
+    if redis is not None:
+        logger.info(" Кэш транскрибаций использует Redis")
+    return TranscriptionCache(redis)
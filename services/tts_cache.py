@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict
+from redis.asyncio import Redis
+from core.config import settings
+from database.redis_storage import connect_redis
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class DiskTTSBackend:
+    """Хранение аудио на локальном диске с вытеснением по LRU в пределах бюджета байт"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self._directory = Path(directory)
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._file_ids: Dict[str, str] = {}
+        self._total_bytes = 0
+        self._load()
+
+    def _load(self):
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+        audio_files = sorted(self._directory.glob("*.audio"), key=lambda p: p.stat().st_mtime)
+        for path in audio_files:
+            size = path.stat().st_size
+            self._entries[path.stem] = size
+            self._total_bytes += size
+
+        for path in self._directory.glob("*.file_id"):
+            if path.stem in self._entries:
+                self._file_ids[path.stem] = path.read_text().strip()
+
+        logger.info(f" TTS кэш на диске: {len(self._entries)} записей, {self._total_bytes} байт")
+
+    def _audio_path(self, key: str) -> Path:
+        return self._directory / f"{key}.audio"
+
+    def _file_id_path(self, key: str) -> Path:
+        return self._directory / f"{key}.file_id"
+
+    async def get_audio(self, key: str) -> Optional[bytes]:
+
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        try:
+            path = self._audio_path(key)
+            data = await asyncio.to_thread(path.read_bytes)
+            await asyncio.to_thread(os.utime, path)
+            return data
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+
+    async def set_audio(self, key: str, data: bytes) -> None:
+
+        await asyncio.to_thread(self._audio_path(key).write_bytes, data)
+        self._total_bytes += len(data) - self._entries.pop(key, 0)
+        self._entries[key] = len(data)
+        await self._evict()
+
+    async def get_file_id(self, key: str) -> Optional[str]:
+
+        file_id = self._file_ids.get(key)
+        if file_id is not None and key in self._entries:
+            self._entries.move_to_end(key)
+        return file_id
+
+    async def set_file_id(self, key: str, file_id: str) -> None:
+
+        if key not in self._entries:
+            return
+        self._file_ids[key] = file_id
+        await asyncio.to_thread(self._file_id_path(key).write_text, file_id)
+
+    def _forget(self, key: str):
+
+        self._total_bytes -= self._entries.pop(key, 0)
+        self._file_ids.pop(key, None)
+
+    async def _evict(self):
+
+        while self._total_bytes > self._max_bytes and self._entries:
+            key, _ = next(iter(self._entries.items()))
+            self._forget(key)
+            for path in (self._audio_path(key), self._file_id_path(key)):
+                try:
+                    await asyncio.to_thread(path.unlink)
+                except FileNotFoundError:
+                    pass
+
+    async def close(self) -> None:
+        pass
+
+class RedisTTSBackend:
+    """Хранение аудио в Redis; порядок LRU ведется в sorted set по времени доступа"""
+
+    def __init__(self, redis: Redis, max_bytes: int, prefix: str = "tts_cache"):
+        self._redis = redis
+        self._max_bytes = max_bytes
+        self._prefix = prefix
+
+    def _key(self, kind: str, key: str = "") -> str:
+        return f"{self._prefix}:{kind}:{key}" if key else f"{self._prefix}:{kind}"
+
+    async def get_audio(self, key: str) -> Optional[bytes]:
+
+        data = await self._redis.get(self._key("audio", key))
+        if data is not None:
+            await self._redis.zadd(self._key("lru"), {key: time.time()})
+        return data
+
+    async def set_audio(self, key: str, data: bytes) -> None:
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._key("audio", key), data)
+            pipe.hget(self._key("sizes"), key)
+            pipe.hset(self._key("sizes"), key, len(data))
+            pipe.zadd(self._key("lru"), {key: time.time()})
+            _, previous_size, *_ = await pipe.execute()
+
+        total = await self._redis.incrby(self._key("bytes"), len(data) - int(previous_size or 0))
+        while total > self._max_bytes:
+            oldest = await self._redis.zpopmin(self._key("lru"))
+            if not oldest:
+                break
+            evicted = oldest[0][0].decode() if isinstance(oldest[0][0], bytes) else oldest[0][0]
+            size = await self._redis.hget(self._key("sizes"), evicted)
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.delete(self._key("audio", evicted), self._key("file_id", evicted))
+                pipe.hdel(self._key("sizes"), evicted)
+                pipe.decrby(self._key("bytes"), int(size or 0))
+                *_, total = await pipe.execute()
+
+    async def get_file_id(self, key: str) -> Optional[str]:
+
+        file_id = await self._redis.get(self._key("file_id", key))
+        if file_id is None:
+            return None
+        await self._redis.zadd(self._key("lru"), {key: time.time()})
+        return file_id.decode() if isinstance(file_id, bytes) else file_id
+
+    async def set_file_id(self, key: str, file_id: str) -> None:
+
+        if await self._redis.exists(self._key("audio", key)):
+            await self._redis.set(self._key("file_id", key), file_id)
+
+    async def close(self) -> None:
+
+        await self._redis.aclose()
+
+class TTSCache:
+    """Контентно-адресуемый кэш синтезированной речи и Telegram file_id"""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.file_id_hits = 0
+
+    @staticmethod
+    def key(text: str, voice: str, model: str, *variant: str) -> str:
+        parts = [model, voice, *variant, text]
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    async def get_audio(self, key: str) -> Optional[bytes]:
+
+        try:
+            data = await self._backend.get_audio(key)
+        except Exception as e:
+            logger.warning(f" Ошибка чтения TTS кэша: {e}")
+            data = None
+
+        if data is None:
+            self.misses += 1
+            metrics.tts_cache_lookups.inc(kind="audio", result="miss")
+        else:
+            self.hits += 1
+            metrics.tts_cache_lookups.inc(kind="audio", result="hit")
+        return data
+
+    async def set_audio(self, key: str, data: bytes) -> None:
+
+        try:
+            await self._backend.set_audio(key, data)
+        except Exception as e:
+            logger.warning(f" Ошибка записи в TTS кэш: {e}")
+
+    async def get_file_id(self, key: str) -> Optional[str]:
+
+        try:
+            file_id = await self._backend.get_file_id(key)
+        except Exception as e:
+            logger.warning(f" Ошибка чтения TTS кэша: {e}")
+            return None
+
+        if file_id is not None:
+            self.file_id_hits += 1
+        metrics.tts_cache_lookups.inc(kind="file_id", result="miss" if file_id is None else "hit")
+        return file_id
+
+    async def set_file_id(self, key: str, file_id: str) -> None:
+
+        try:
+            await self._backend.set_file_id(key, file_id)
+        except Exception as e:
+            logger.warning(f" Ошибка записи в TTS кэш: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'file_id_hits': self.file_id_hits
+        }
+
+    async def close(self) -> None:
+
+        logger.info(f" Статистика TTS кэша: {self.stats()}")
+        await self._backend.close()
+
+async def create_tts_cache() -> Optional[TTSCache]:
+    """Создание TTS кэша по настройкам; Redis при недоступности заменяется диском"""
+    backend_name = settings.tts_cache_backend
+    if backend_name == "none":
+        return None
+
+    if backend_name == "redis":
+        redis = await connect_redis(decode_responses=False)
+        if redis is not None:
+            logger.info(" TTS кэш использует Redis")
+            return TTSCache(RedisTTSBackend(redis, settings.tts_cache_max_bytes))
+        logger.warning(" TTS кэш переключен на диск")
+
+    backend = await asyncio.to_thread(DiskTTSBackend, settings.tts_cache_dir, settings.tts_cache_max_bytes)
+    return TTSCache(backend)
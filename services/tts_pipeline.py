@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import re
+from contextlib import nullcontext
+from typing import Optional, List, Union, Callable, Awaitable, AsyncContextManager
+from core.config import settings
+from core.exeptions import VoiceProcessingError
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])[\"»)\]]*\s+|\n+")
+
+SegmentSender = Callable[[int, Union[str, bytes], str], Awaitable[Optional[str]]]
+
+class SentenceChunker:
+    """Накопление текста и выдача фрагментов по границам предложений.
+
+    Первый фрагмент делается коротким, чтобы первое аудио появилось как можно
+    раньше; следующие собираются из нескольких предложений до max_chars.
+    """
+
+    def __init__(self, first_chars: Optional[int] = None, max_chars: Optional[int] = None):
+        self._first_chars = first_chars or settings.tts_first_chunk_chars
+        self._max_chars = max_chars or settings.tts_chunk_max_chars
+        self._buffer = ""
+        self._pending: List[str] = []
+        self._emitted = 0
+
+    def _target(self) -> int:
+        return self._first_chars if self._emitted == 0 else self._max_chars
+
+    def _take_sentences(self) -> List[str]:
+
+        sentences = []
+        position = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            sentence = self._buffer[position:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            position = match.end()
+        self._buffer = self._buffer[position:]
+        return sentences
+
+    def _split_long(self, sentence: str) -> List[str]:
+
+        parts = []
+        while len(sentence) > self._max_chars:
+            cut = sentence.rfind(" ", 0, self._max_chars)
+            cut = cut if cut > 0 else self._max_chars
+            parts.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            parts.append(sentence)
+        return parts
+
+    def _collect(self, final: bool) -> List[str]:
+
+        chunks = []
+        while self._pending:
+            size = 0
+            count = 0
+            for sentence in self._pending:
+                if count and size + len(sentence) + 1 > self._max_chars:
+                    break
+                size += len(sentence) + 1
+                count += 1
+                if size >= self._target():
+                    break
+            if size < self._target() and count == len(self._pending) and not final:
+                break
+            chunks.append(" ".join(self._pending[:count]))
+            del self._pending[:count]
+            self._emitted += 1
+        return chunks
+
+    def feed(self, text: str) -> List[str]:
+        """Добавление текста; возвращает готовые фрагменты"""
+        self._buffer += text
+        for sentence in self._take_sentences():
+            self._pending.extend(self._split_long(sentence))
+        return self._collect(final=False)
+
+    def flush(self) -> List[str]:
+        """Выдача оставшегося текста по окончании ответа"""
+        tail = self._buffer.strip()
+        self._buffer = ""
+        if tail:
+            self._pending.extend(self._split_long(tail))
+        return self._collect(final=True)
+
+def split_sentences(text: str) -> List[str]:
+    """Разбиение готового текста на фрагменты для синтеза"""
+    chunker = SentenceChunker()
+    return chunker.feed(text) + chunker.flush()
+
+class TTSPipeline:
+    """Конвейерный синтез речи по фрагментам.
+
+    Фрагменты синтезируются параллельно (не больше parallelism одновременно),
+    а отправляются строго по порядку: первый сегмент уходит сразу, как только
+    готов, не дожидаясь остальных. Если для фрагмента в TTS кэше уже есть
+    Telegram file_id, синтез пропускается.
+    """
+
+    def __init__(self, openai_service, send_segment: SegmentSender,
+                 stage: Optional[Callable[[], AsyncContextManager]] = None, parallelism: Optional[int] = None,
+                 deadline=None):
+        self._service = openai_service
+        self._deadline = deadline
+        self._send_segment = send_segment
+        self._stage = stage or nullcontext
+        self._semaphore = asyncio.Semaphore(parallelism or settings.tts_pipeline_parallelism)
+        self._chunker = SentenceChunker()
+        self._queue: "asyncio.Queue[Optional[tuple[int, str, asyncio.Task]]]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._sender: Optional[asyncio.Task] = None
+        self._sent = 0
+        self._finished = False
+
+    async def __aenter__(self) -> "TTSPipeline":
+        self._sender = asyncio.create_task(self._send_in_order())
+        self._sender.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if not self._finished:
+            self.cancel()
+
+    def feed(self, text: str) -> None:
+        """Прием очередного фрагмента текста ответа"""
+        for chunk in self._chunker.feed(text):
+            self._schedule(chunk)
+
+    def _schedule(self, chunk: str) -> None:
+
+        index = len(self._tasks)
+        task = asyncio.create_task(self._synthesize(chunk))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._tasks.append(task)
+        self._queue.put_nowait((index, chunk, task))
+
+    async def _synthesize(self, chunk: str) -> Union[str, bytes]:
+
+        tts_cache = self._service.tts_cache
+        if tts_cache is not None:
+            file_id = await tts_cache.get_file_id(self._service.tts_cache_key(chunk))
+            if file_id:
+                return file_id
+
+        async with self._semaphore:
+            async with self._stage():
+                return await self._service.text_to_speech(chunk, deadline=self._deadline)
+
+    async def _send_in_order(self) -> None:
+
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            index, chunk, task = item
+            audio = await task
+            if not audio:
+                raise VoiceProcessingError("Пустой аудио сегмент")
+
+            file_id = await self._send_segment(index, audio, chunk)
+            self._sent += 1
+            if index == 0:
+                logger.info(" Первый аудио сегмент отправлен")
+
+            tts_cache = self._service.tts_cache
+            if tts_cache is not None and file_id and isinstance(audio, bytes):
+                await tts_cache.set_file_id(self._service.tts_cache_key(chunk), file_id)
+
+    async def finish(self) -> int:
+        """Синтез остатка текста и ожидание отправки всех сегментов"""
+        for chunk in self._chunker.flush():
+            self._schedule(chunk)
+        self._queue.put_nowait(None)
+
+        try:
+            await self._sender
+        finally:
+            self._finished = True
+            self.cancel()
+
+        logger.info(f" Отправлено аудио сегментов: {self._sent}")
+        return self._sent
+
+    def cancel(self) -> None:
+
+        for task in self._tasks:
+            task.cancel()
+        if self._sender is not None:
+            self._sender.cancel()
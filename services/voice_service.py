@@ -1,34 +1,229 @@
 import aiofiles
+import asyncio
+import io
+import logging
 import os
-from typing import Tuple
+import shutil
+import numpy as np
+from typing import Optional, Tuple, List
+from core.config import settings
 from core.exeptions import VoiceProcessingError
+from services.metrics import metrics
+from services.spool import spool_directory, unique_path, remove_file
+
+logger = logging.getLogger(__name__)
+
+PCM_DTYPE = np.int16
+
+def frame_energy_db(samples: np.ndarray, frame: int) -> np.ndarray:
+    """Энергия последовательных кадров в дБ относительно полной шкалы"""
+    frames = len(samples) // frame
+    blocks = samples[:frames * frame].reshape(frames, frame).astype(np.float32) / np.iinfo(PCM_DTYPE).max
+    return 10 * np.log10(np.mean(blocks * blocks, axis=1) + 1e-10)
+
+def detect_speech(samples: np.ndarray, sample_rate: int) -> Optional[Tuple[int, int]]:
+    """Границы речи по энергии кадров: (начало, конец) в отсчетах или None, если речи нет.
+    
+    Порог - уровень шума (10-й перцентиль энергии кадров) плюс
+    vad_noise_margin_db, но не выше самого громкого кадра минус
+    vad_peak_margin_db и не ниже абсолютного vad_threshold_db. Пустой
+    считается только запись тише абсолютного порога: если на шумной
+    записи границы речи не найдены, возвращается вся запись.
+    """
+    frame = max(1, sample_rate * settings.vad_frame_ms // 1000)
+    if len(samples) < frame:
+        return None
+    
+    energy_db = frame_energy_db(samples, frame)
+    peak = float(energy_db.max())
+    if peak <= settings.vad_threshold_db:
+        return None
+    
+    noise_floor = float(np.percentile(energy_db, 10))
+    threshold = max(
+        settings.vad_threshold_db,
+        min(noise_floor + settings.vad_noise_margin_db, peak - settings.vad_peak_margin_db)
+    )
+    
+    voiced = np.flatnonzero(energy_db > threshold)
+    if len(voiced) * settings.vad_frame_ms < settings.vad_min_speech_ms:
+        return 0, len(samples)
+    
+    padding = sample_rate * settings.vad_padding_ms // 1000
+    start = max(0, voiced[0] * frame - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame + padding)
+    return start, end
+
+def split_at_silences(samples: np.ndarray, sample_rate: int, max_seconds: float,
+                      overlap_seconds: float = 0.0) -> List[Tuple[int, int]]:
+    """Границы сегментов не длиннее max_seconds с разрезом в самом тихом кадре.
+    
+    Разрез ищется в последней трети допустимой длины сегмента; каждый
+    следующий сегмент начинается на overlap_seconds раньше разреза.
+    overlap_seconds должен быть меньше двух третей max_seconds.
+    """
+    max_length = int(max_seconds * sample_rate)
+    if len(samples) <= max_length:
+        return [(0, len(samples))]
+    
+    frame = max(1, sample_rate * settings.vad_frame_ms // 1000)
+    energy_db = frame_energy_db(samples, frame)
+    overlap = int(overlap_seconds * sample_rate)
+    
+    segments = []
+    start = 0
+    while len(samples) - start > max_length:
+        low = (start + max_length * 2 // 3) // frame
+        high = max(low + 1, (start + max_length) // frame)
+        quietest = low + int(np.argmin(energy_db[low:high]))
+        cut = quietest * frame + frame // 2
+        segments.append((start, cut))
+        start = max(start + 1, cut - overlap)
+    segments.append((start, len(samples)))
+    return segments
 
 class VoiceService:
     @staticmethod
-    async def download_voice_file(file_id: str, bot) -> str:
-        
+    async def download_voice_file(file_id: str, bot) -> io.BytesIO:
+        """Загрузка файла из Telegram в память"""
         try:
-            file = await bot.get_file(file_id)
-            file_path = file.file_path
-            
-            
-            os.makedirs("temp", exist_ok=True)
-            
-            
-            temp_voice_path = f"temp/voice_{file_id}.ogg"
-            await bot.download_file(file_path, temp_voice_path)
+            with metrics.stage("download"):
+                file = await bot.get_file(file_id)
+                file_path = file.file_path
+                
+                buffer = await bot.download_file(file_path)
+                buffer.name = os.path.basename(file_path) or "voice.ogg"
+            metrics.download_bytes.observe(buffer.getbuffer().nbytes)
             
-            return temp_voice_path
+            return buffer
             
         except Exception as e:
             raise VoiceProcessingError(f"Ошибка загрузки голосового сообщения: {str(e)}")
     
     @staticmethod
-    async def save_audio_response(audio_data, user_id: int) -> str:
+    async def _ffmpeg(ffmpeg: str, audio_data: bytes, *args: str) -> bytes:
+        """Запуск ffmpeg с обменом данными через pipe"""
+        process = await asyncio.create_subprocess_exec(
+            ffmpeg, "-hide_banner", "-loglevel", "error", *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        output, error = await process.communicate(audio_data)
+        
+        if process.returncode != 0 or not output:
+            raise VoiceProcessingError(f"Ошибка обработки аудио: {error.decode(errors='ignore').strip()}")
+        return output
+    
+    @staticmethod
+    async def transcode_opus(audio_data: bytes, bitrate: str) -> bytes:
+        """Перекодирование в OGG/Opus с заданным битрейтом через ffmpeg"""
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            logger.warning(" ffmpeg не найден, аудио отправляется без перекодирования")
+            return audio_data
+        
+        output = await VoiceService._ffmpeg(
+            ffmpeg, audio_data,
+            "-i", "pipe:0",
+            "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+            "-f", "ogg", "pipe:1"
+        )
+        
+        logger.info(f" Аудио перекодировано: {len(audio_data)} -> {len(output)} байт ({bitrate})")
+        return output
+    
+    @staticmethod
+    async def decode_pcm(audio_data: bytes, sample_rate: int) -> np.ndarray:
+        """Декодирование в моно PCM с заданной частотой дискретизации"""
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise VoiceProcessingError("ffmpeg не найден")
+        
+        output = await VoiceService._ffmpeg(
+            ffmpeg, audio_data,
+            "-i", "pipe:0",
+            "-ac", "1", "-ar", str(sample_rate),
+            "-f", "s16le", "pipe:1"
+        )
+        return np.frombuffer(output, dtype=PCM_DTYPE)
+    
+    @staticmethod
+    async def encode_pcm(samples: np.ndarray, sample_rate: int, bitrate: str) -> bytes:
+        """Сжатие моно PCM в OGG/Opus для загрузки в Whisper"""
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise VoiceProcessingError("ffmpeg не найден")
+        
+        return await VoiceService._ffmpeg(
+            ffmpeg, samples.astype(PCM_DTYPE, copy=False).tobytes(),
+            "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "-i", "pipe:0",
+            "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+            "-f", "ogg", "pipe:1"
+        )
+    
+    @staticmethod
+    async def preprocess_audio(buffer: io.BytesIO) -> Optional[List[io.BytesIO]]:
+        """Подготовка аудио к распознаванию: моно 16 кГц без тишины в начале и конце.
+        
+        Длинные записи делятся по паузам на сегменты не длиннее
+        stt_segment_seconds для параллельной транскрибации. Возвращает None,
+        если запись тише абсолютного порога vad_threshold_db. Если аудио не удалось декодировать,
+        возвращается исходный буфер.
+        """
+        if not settings.audio_preprocessing:
+            return [buffer]
+        
+        original = buffer.getvalue()
+        sample_rate = settings.stt_sample_rate
+        try:
+            with metrics.stage("preprocess"):
+                samples = await VoiceService.decode_pcm(original, sample_rate)
+                speech = await asyncio.to_thread(detect_speech, samples, sample_rate)
+                if speech is None:
+                    logger.info(f" Речь не обнаружена в аудио длительностью {len(samples) / sample_rate:.1f} с")
+                    return None
+                
+                start, end = speech
+                speech_samples = samples[start:end]
+                bounds = await asyncio.to_thread(
+                    split_at_silences, speech_samples, sample_rate,
+                    settings.stt_segment_seconds, settings.stt_segment_overlap
+                )
+                encoded = await asyncio.gather(*[
+                    VoiceService.encode_pcm(speech_samples[low:high], sample_rate, settings.stt_bitrate)
+                    for low, high in bounds
+                ])
+        except VoiceProcessingError as e:
+            logger.warning(f" Предобработка аудио пропущена: {e}")
+            buffer.seek(0)
+            return [buffer]
+        
+        encoded_size = sum(len(segment) for segment in encoded)
+        if len(encoded) == 1 and encoded_size >= len(original) and end - start == len(samples):
+            buffer.seek(0)
+            return [buffer]
+        
+        trimmed_seconds = (len(samples) - (end - start)) / sample_rate
+        logger.info(
+            f" Аудио подготовлено: {len(original)} -> {encoded_size} байт в {len(encoded)} сегм., "
+            f"сэкономлено {len(original) - encoded_size} байт и {trimmed_seconds:.1f} с тишины"
+        )
         
+        segments = []
+        for index, data in enumerate(encoded):
+            segment = io.BytesIO(data)
+            segment.name = f"speech_{index}.ogg"
+            segments.append(segment)
+        return segments
+    
+    @staticmethod
+    async def save_audio_response(audio_data, user_id: int, extension: str = "ogg") -> str:
+        """Сохранение аудио во временный каталог под уникальным для запроса именем"""
         try:
-            os.makedirs("temp", exist_ok=True)
-            output_path = f"temp/response_{user_id}.mp3"
+            directory = spool_directory()
+            directory.mkdir(parents=True, exist_ok=True)
+            output_path = str(unique_path(directory, f"response_{user_id}", f".{extension}"))
             
             if hasattr(audio_data, 'read'):
                 
@@ -48,8 +243,4 @@ class VoiceService:
     def cleanup_files(*file_paths):
         
         for file_path in file_paths:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except:
-                pass
+            remove_file(file_path)